@@ -1,127 +1,100 @@
 import asyncio
-import csv
+import contextlib
+import gzip
 import json
+import os
+import zlib
 from datetime import datetime, timedelta
+
+import aiofiles
+from aiogram.types import InputFile
+
+from aggregation import TOP_INTERESTS_QUERY, USER_STATS_QUERY
 from database import Database
 import config
 
 db = Database()
 
+# Таблицы полного бэкапа в порядке восстановления (сначала те, на кого
+# ссылаются). Производные таблицы (user_counters, daily_activity, теги)
+# не сохраняются: после восстановления они пересчитываются
+BACKUP_TABLES = ('users', 'likes', 'skips', 'matches', 'profile_exposure')
+BACKUP_FORMAT = 'pgcopy-binary-gzip-1'
+RESTORE_CHUNK_SIZE = 1024 * 1024
+
+
+def _gzip_writer(write):
+    """(on_chunk, finish): сжимает куски на лету и отдает их в write"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 - формат gzip
+
+    async def on_chunk(chunk):
+        data = compressor.compress(chunk)
+        if data:
+            await write(data)
+
+    async def finish():
+        await write(compressor.flush())
+
+    return on_chunk, finish
+
+
+async def _read_gzip(filename):
+    """Распакованное содержимое файла .gz кусками, без чтения целиком"""
+    decompressor = zlib.decompressobj(31)
+    async with aiofiles.open(filename, 'rb') as f:
+        while True:
+            chunk = await f.read(RESTORE_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
 class AdminTools:
     @staticmethod
-    async def get_user_stats_csv():
-        """Выгрузка статистики пользователей в CSV"""
-        async with db.pool.acquire() as conn:
-            # Получаем расширенную статистику
-            rows = await conn.fetch("""
-                SELECT 
-                    u.id,
-                    u.telegram_id,
-                    u.name,
-                    u.interest_area,
-                    u.expertise_area,
-                    u.created_at,
-                    COUNT(DISTINCT l_sent.id) as likes_sent,
-                    COUNT(DISTINCT l_received.id) as likes_received,
-                    COUNT(DISTINCT s.id) as skips_sent,
-                    (SELECT COUNT(*) FROM likes l2 
-                     JOIN users u2 ON l2.from_user_id = u2.id 
-                     WHERE l2.to_user_id = u.id 
-                     AND EXISTS (
-                         SELECT 1 FROM likes l3 
-                         WHERE l3.from_user_id = u.id 
-                         AND l3.to_user_id = l2.from_user_id
-                     )) as mutual_likes,
-                    CASE 
-                        WHEN (SELECT COUNT(*) FROM likes WHERE from_user_id = u.id) > 0 
-                        THEN ROUND(
-                            ((SELECT COUNT(*) FROM likes WHERE to_user_id = u.id)::numeric /
-                            (SELECT COUNT(*) FROM likes WHERE from_user_id = u.id)::numeric)::numeric, 
-                            2
-                        )
-                        ELSE 0.0 
-                    END as like_ratio
-                FROM users u
-                LEFT JOIN likes l_sent ON l_sent.from_user_id = u.id
-                LEFT JOIN likes l_received ON l_received.to_user_id = u.id
-                LEFT JOIN skips s ON s.from_user_id = u.id
-                GROUP BY u.id
-                ORDER BY u.created_at DESC
-            """)
-            
-            # Конвертируем в словари
-            dict_rows = [dict(row) for row in rows]
-            
-            # Сохраняем в CSV
-            filename = f"user_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            with open(filename, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=[
-                    'id', 'telegram_id', 'name', 'interest_area', 'expertise_area',
-                    'created_at', 'likes_sent', 'likes_received', 'skips_sent',
-                    'mutual_likes', 'like_ratio'
-                ])
-                writer.writeheader()
-                for row in dict_rows:
-                    # Преобразуем datetime в строку
-                    row_dict = dict(row)
-                    if 'created_at' in row_dict and row_dict['created_at']:
-                        row_dict['created_at'] = row_dict['created_at'].isoformat()
-                    writer.writerow(row_dict)
-            
-            return filename, len(dict_rows)
+    async def stream_query_csv(query, write, *args, database=None):
+        """Результат запроса в gzip-CSV, по кускам.
+
+        Строки идут из COPY ... TO STDOUT и сжимаются на лету, write
+        получает сжатые куски. В памяти никогда нет всей выгрузки.
+        Возвращает число выгруженных строк.
+        """
+        database = database or db
+        on_chunk, finish = _gzip_writer(write)
+        async with database.connection() as conn:
+            status = await conn.copy_from_query(
+                query, *args, output=on_chunk, format='csv', header=True
+            )
+        await finish()
+        return int(status.split()[-1])
+
+    @staticmethod
+    async def stream_user_stats_csv(write, database=None):
+        """Статистика пользователей в gzip-CSV, по кускам"""
+        return await AdminTools.stream_query_csv(USER_STATS_QUERY, write, database=database)
+
+    @staticmethod
+    async def get_user_stats_csv(database=None):
+        """Выгрузка статистики пользователей в файл .csv.gz"""
+        filename = f"user_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.gz"
+        async with aiofiles.open(filename, 'wb') as f:
+            count = await AdminTools.stream_user_stats_csv(f.write, database)
+        return filename, count
 
     @staticmethod
     async def get_activity_timeline(days=7):
         """Активность по дням"""
-        async with db.pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT 
-                    DATE(created_at) as date,
-                    COUNT(CASE WHEN table_name = 'users' THEN 1 END) as new_users,
-                    COUNT(CASE WHEN table_name = 'likes' THEN 1 END) as likes,
-                    COUNT(CASE WHEN table_name = 'skips' THEN 1 END) as skips
-                FROM (
-                    SELECT created_at, 'users' as table_name FROM users
-                    UNION ALL
-                    SELECT created_at, 'likes' as table_name FROM likes
-                    UNION ALL
-                    SELECT created_at, 'skips' as table_name FROM skips
-                ) all_events
-                WHERE created_at >= CURRENT_DATE - ($1 || ' days')::interval
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """, str(days))
-            
-            return [dict(row) for row in rows]
+        return await db.get_activity_timeline(days)
 
     @staticmethod
     async def get_top_interests(limit=10):
         """Самые популярные интересы"""
         async with db.pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT 
-                    interest_area,
-                    COUNT(*) as user_count,
-                    COALESCE(
-                        ROUND(
-                            AVG(
-                                CASE 
-                                    WHEN (SELECT COUNT(*) FROM likes WHERE from_user_id = u.id) > 0 
-                                    THEN (SELECT COUNT(*) FROM likes WHERE to_user_id = u.id)::numeric /
-                                         (SELECT COUNT(*) FROM likes WHERE from_user_id = u.id)::numeric
-                                    ELSE 0.0 
-                                END
-                            )::numeric,
-                            2
-                        ),
-                        0.0
-                    ) as avg_like_ratio
-                FROM users u
-                WHERE interest_area IS NOT NULL AND interest_area != ''
-                GROUP BY interest_area
-                ORDER BY user_count DESC
-                LIMIT $1
-            """, limit)
+            rows = await conn.fetch(TOP_INTERESTS_QUERY, limit)
             
             return [dict(row) for row in rows]
 
@@ -146,16 +119,8 @@ class AdminTools:
                 WHERE created_at::date = CURRENT_DATE
             """)
             
-            # Взаимные лайки (упрощенный запрос)
-            mutual = await conn.fetchval("""
-                SELECT COUNT(*) FROM (
-                    SELECT DISTINCT LEAST(l1.from_user_id, l1.to_user_id) as user1,
-                                    GREATEST(l1.from_user_id, l1.to_user_id) as user2
-                    FROM likes l1
-                    JOIN likes l2 ON l1.from_user_id = l2.to_user_id 
-                        AND l1.to_user_id = l2.from_user_id
-                ) t
-            """)
+            # Взаимные пары
+            mutual = await conn.fetchval("SELECT COUNT(*) FROM matches")
             
             return {
                 'total_users': total_users,
@@ -167,37 +132,150 @@ class AdminTools:
             }
 
     @staticmethod
-    async def export_full_database():
-        """Полная выгрузка базы для бэкапа"""
-        async with db.pool.acquire() as conn:
-            # Все таблицы
-            tables = ['users', 'likes', 'skips']
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            exported_files = []
-            
-            for table in tables:
-                rows = await conn.fetch(f"SELECT * FROM {table}")
-                filename = f"{table}_export_{timestamp}.json"
-                
-                # Конвертируем строки в словари
-                data = []
-                for row in rows:
-                    row_dict = {}
-                    for key, value in dict(row).items():
-                        # Преобразуем datetime в строку
-                        if hasattr(value, 'isoformat'):
-                            row_dict[key] = value.isoformat()
-                        else:
-                            row_dict[key] = value
-                    data.append(row_dict)
-                
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                
-                print(f"✅ Экспортировано {len(data)} записей из {table} в {filename}")
-                exported_files.append(filename)
-            
-            return f"Экспорт завершен. Файлы: {', '.join(exported_files)}"
+    async def export_full_database(directory=None, database=None):
+        """Полная выгрузка базы для бэкапа.
+
+        Каждая таблица из BACKUP_TABLES пишется в свой файл
+        <таблица>.copy.gz: двоичный COPY Postgres, сжатый на лету, так что
+        память не зависит от размера таблицы. Все таблицы читаются в одной
+        REPEATABLE READ транзакции - бэкап согласован между таблицами.
+        Рядом кладется manifest.json с колонками и числом строк. Обратная
+        операция - restore_full_database.
+        """
+        database = database or db
+        directory = directory or f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        os.makedirs(directory, exist_ok=True)
+        manifest = {
+            'format': BACKUP_FORMAT,
+            'created_at': datetime.now().isoformat(),
+            'tables': [],
+        }
+
+        async with database.connection() as conn:
+            manifest['server_version'] = conn.get_server_version().major
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                for table in BACKUP_TABLES:
+                    columns = await conn.fetchval("""
+                        SELECT array_agg(attname::text ORDER BY attnum)
+                        FROM pg_attribute
+                        WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped
+                    """, table)
+                    filename = f"{table}.copy.gz"
+                    async with aiofiles.open(os.path.join(directory, filename), 'wb') as f:
+                        on_chunk, finish = _gzip_writer(f.write)
+                        status = await conn.copy_from_table(
+                            table, columns=columns, output=on_chunk, format='binary'
+                        )
+                        await finish()
+                    rows = int(status.split()[-1])
+                    manifest['tables'].append({
+                        'name': table,
+                        'file': filename,
+                        'columns': columns,
+                        'rows': rows,
+                        'bytes': os.path.getsize(os.path.join(directory, filename)),
+                    })
+                    print(f"✅ Экспортировано {rows} записей из {table}")
+
+        async with aiofiles.open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(manifest, ensure_ascii=False, indent=2))
+        return f"Экспорт завершен. Каталог: {directory}"
+
+    @staticmethod
+    async def restore_full_database(directory, database=None):
+        """Восстанавливает базу из бэкапа export_full_database.
+
+        Таблицы бэкапа очищаются и заливаются через COPY одной
+        транзакцией. Триггеры счетчиков и активности на время заливки
+        выключены (построчный триггер лайков на миллионах строк медленный
+        и упирается в лимит блокировок), производные таблицы потом
+        пересчитываются целиком.
+        """
+        database = database or db
+        async with aiofiles.open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.loads(await f.read())
+        if manifest.get('format') != BACKUP_FORMAT:
+            raise ValueError(f"Неизвестный формат бэкапа: {manifest.get('format')}")
+        tables = [t['name'] for t in manifest['tables']]
+
+        async with database.connection() as conn:
+            if conn.get_server_version().major != manifest.get('server_version'):
+                print(f"⚠️ Бэкап снят с Postgres {manifest.get('server_version')}, "
+                      f"восстанавливаем в {conn.get_server_version().major}")
+            async with conn.transaction():
+                await conn.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE")
+                # После восстановления выгрузка должна начаться со снимка
+                await conn.execute("TRUNCATE export_watermarks")
+                for table in tables:
+                    await conn.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+                for entry in manifest['tables']:
+                    status = await conn.copy_to_table(
+                        entry['name'],
+                        source=_read_gzip(os.path.join(directory, entry['file'])),
+                        columns=entry['columns'],
+                        format='binary'
+                    )
+                    rows = int(status.split()[-1])
+                    if rows != entry['rows']:
+                        raise ValueError(f"{entry['name']}: в бэкапе {entry['rows']} строк, загружено {rows}")
+                    print(f"✅ Восстановлено {rows} записей в {entry['name']}")
+                for entry in manifest['tables']:
+                    table = entry['name']
+                    await conn.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+                    sequence = None
+                    if 'id' in entry['columns']:
+                        sequence = await conn.fetchval("SELECT pg_get_serial_sequence($1, 'id')", table)
+                    if sequence:
+                        # Новые id продолжаются после восстановленных
+                        await conn.execute(
+                            f"SELECT setval($1, COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table}",
+                            sequence
+                        )
+
+        await database.rebuild_counters()
+        await database.rebuild_activity()
+        await database.rebuild_tags()
+        restored = ', '.join(f"{t['name']} {t['rows']}" for t in manifest['tables'])
+        return f"Восстановление завершено: {restored}"
+
+class UserStatsUpload(InputFile):
+    """Отчет по пользователям для answer_document без временного файла:
+    сжатый CSV из COPY уходит прямо в запрос к Telegram"""
+
+    def __init__(self, database=None):
+        super().__init__(f"user_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.gz")
+        self.database = database
+        self.rows = None
+
+    async def read(self, bot):
+        # Небольшая очередь: COPY не обгоняет отправку больше чем на пару кусков
+        queue = asyncio.Queue(maxsize=4)
+
+        async def produce():
+            try:
+                self.rows = await AdminTools.stream_user_stats_csv(queue.put, self.database)
+            except asyncio.CancelledError:
+                # Читатель ушел (ошибка отправки, aclose) - конец потока
+                # ждать некому, а очередь может быть полна
+                raise
+            except Exception:
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
 
 # Быстрая проверка (упрощенная)
 async def test_admin_tools():
@@ -237,7 +315,7 @@ async def test_admin_tools():
         # Покажем содержимое CSV
         print(f"\n📄 Первые 3 строки из {filename}:")
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
+            with gzip.open(filename, 'rt', encoding='utf-8') as f:
                 lines = f.readlines()
                 for i, line in enumerate(lines[:4]):  # Заголовок + 3 строки
                     print(f"   {line.strip()}")
@@ -0,0 +1,103 @@
+# Метрики пользователей за один проход по таблицам.
+#
+# Каждая базовая таблица читается один раз и сразу группируется по
+# пользователю, а потом к users присоединяются уже готовые агрегаты - без
+# размножения строк и без подзапросов на каждого пользователя. Запросы
+# собираются через with_user_metrics и используются в CSV, выгрузке и
+# пересчете user_counters.
+
+USER_METRICS_CTES = """
+    -- likes читается один раз: каждая строка дает лайк отправителю и получателю
+    like_counts AS (
+        SELECT v.user_id,
+               COUNT(*) FILTER (WHERE v.sent) AS likes_sent,
+               COUNT(*) FILTER (WHERE NOT v.sent) AS likes_received
+        FROM likes l
+        CROSS JOIN LATERAL (VALUES (l.from_user_id, true), (l.to_user_id, false)) AS v(user_id, sent)
+        GROUP BY v.user_id
+    ),
+    skip_counts AS (
+        SELECT from_user_id AS user_id, COUNT(*) AS skips
+        FROM skips
+        GROUP BY from_user_id
+    ),
+    match_counts AS (
+        SELECT v.user_id, COUNT(*) AS mutual_likes
+        FROM matches m
+        CROSS JOIN LATERAL (VALUES (m.user1_id), (m.user2_id)) AS v(user_id)
+        GROUP BY v.user_id
+    ),
+    user_metrics AS (
+        SELECT u.id,
+               u.telegram_id,
+               u.name,
+               u.interest_area,
+               u.expertise_area,
+               u.created_at,
+               COALESCE(lc.likes_sent, 0) AS likes_sent,
+               COALESCE(lc.likes_received, 0) AS likes_received,
+               COALESCE(sc.skips, 0) AS skips,
+               COALESCE(mc.mutual_likes, 0) AS mutual_likes,
+               CASE
+                   WHEN lc.likes_sent > 0
+                   THEN lc.likes_received::numeric / lc.likes_sent
+                   ELSE 0.0
+               END AS like_ratio
+        FROM users u
+        LEFT JOIN like_counts lc ON lc.user_id = u.id
+        LEFT JOIN skip_counts sc ON sc.user_id = u.id
+        LEFT JOIN match_counts mc ON mc.user_id = u.id
+    )
+"""
+
+
+def with_user_metrics(query):
+    """Подставляет CTE user_metrics перед запросом"""
+    return f"WITH {USER_METRICS_CTES} {query}"
+
+
+# Колонки отчета для админа (CSV), в порядке колонок файла
+USER_STATS_QUERY = with_user_metrics("""
+    SELECT id, telegram_id, name, interest_area, expertise_area, created_at,
+           likes_sent, likes_received,
+           skips AS skips_sent,
+           mutual_likes,
+           ROUND(like_ratio, 2) AS like_ratio
+    FROM user_metrics
+    ORDER BY created_at DESC
+""")
+
+# $1 - сколько интересов вернуть. Интересы берутся из нормализованных тегов
+# (обратный индекс user_tags), отношение лайков - из user_counters по ключу
+TOP_INTERESTS_QUERY = """
+    WITH top AS (
+        SELECT tag_id, COUNT(*) AS user_count
+        FROM user_tags
+        WHERE kind = 'interest'
+        GROUP BY tag_id
+        ORDER BY user_count DESC
+        LIMIT $1
+    )
+    SELECT t.name AS interest_area,
+           top.user_count,
+           COALESCE(ROUND(AVG(
+               CASE
+                   WHEN uc.likes_sent > 0
+                   THEN uc.likes_received::numeric / uc.likes_sent
+                   ELSE 0.0
+               END
+           ), 2), 0.0) AS avg_like_ratio
+    FROM top
+    JOIN tags t ON t.id = top.tag_id
+    JOIN user_tags ut ON ut.tag_id = top.tag_id AND ut.kind = 'interest'
+    LEFT JOIN user_counters uc ON uc.user_id = ut.user_id
+    GROUP BY t.name, top.user_count
+    ORDER BY top.user_count DESC, t.name
+"""
+
+# Содержимое user_counters: только пользователи, у которых есть свайпы
+USER_COUNTERS_QUERY = with_user_metrics("""
+    SELECT id, likes_sent, likes_received, mutual_likes, skips
+    FROM user_metrics
+    WHERE likes_sent > 0 OR likes_received > 0 OR skips > 0
+""")
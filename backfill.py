@@ -0,0 +1,31 @@
+import asyncio
+import sys
+from database import Database
+
+# Задачи пересчета производных таблиц: python backfill.py [задача ...]
+# Без аргументов выполняются все по порядку
+JOBS = {
+    'matches': lambda db: db.backfill_matches(),
+    'counters': lambda db: db.rebuild_counters(),
+    'activity': lambda db: db.rebuild_activity(),
+    'tags': lambda db: db.rebuild_tags(),
+}
+
+async def backfill(jobs):
+    unknown = [job for job in jobs if job not in JOBS]
+    if unknown:
+        print(f"❌ Неизвестные задачи: {', '.join(unknown)}. Доступны: {', '.join(JOBS)}")
+        return
+
+    db = Database()
+    await db.create_pool()
+    try:
+        for job in jobs:
+            print(f"🔄 Пересчет: {job}")
+            await JOBS[job](db)
+        print("🎉 Пересчет завершен!")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(backfill(sys.argv[1:] or list(JOBS)))
@@ -0,0 +1,29 @@
+import argparse
+import asyncio
+
+from admin import AdminTools, db
+
+# Полный бэкап и восстановление:
+#   python backup.py backup [каталог]
+#   python backup.py restore <каталог>
+
+
+async def run(command, directory):
+    await db.create_pool()
+    try:
+        if command == "backup":
+            print(f"🎉 {await AdminTools.export_full_database(directory, database=db)}")
+        else:
+            print(f"🎉 {await AdminTools.restore_full_database(directory, database=db)}")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бэкап базы в сжатый двоичный COPY и восстановление из него")
+    parser.add_argument("command", choices=["backup", "restore"])
+    parser.add_argument("directory", nargs="?")
+    args = parser.parse_args()
+    if args.command == "restore" and not args.directory:
+        parser.error("для restore нужен каталог бэкапа")
+    asyncio.run(run(args.command, args.directory))
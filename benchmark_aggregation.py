@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import os
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+from aggregation import USER_STATS_QUERY
+
+load_dotenv()
+
+SCHEMA = "bench_aggregation"
+
+# Прежние запросы с JOIN + COUNT(DISTINCT) и подзапросами на каждого пользователя
+LEGACY_USER_STATS_QUERY = """
+    SELECT
+        u.id,
+        u.telegram_id,
+        u.name,
+        u.interest_area,
+        u.expertise_area,
+        u.created_at,
+        COUNT(DISTINCT l_sent.id) as likes_sent,
+        COUNT(DISTINCT l_received.id) as likes_received,
+        COUNT(DISTINCT s.id) as skips_sent,
+        (SELECT COUNT(*) FROM matches m
+         WHERE m.user1_id = u.id OR m.user2_id = u.id) as mutual_likes,
+        CASE
+            WHEN (SELECT COUNT(*) FROM likes WHERE from_user_id = u.id) > 0
+            THEN ROUND(
+                ((SELECT COUNT(*) FROM likes WHERE to_user_id = u.id)::numeric /
+                (SELECT COUNT(*) FROM likes WHERE from_user_id = u.id)::numeric)::numeric,
+                2
+            )
+            ELSE 0.0
+        END as like_ratio
+    FROM users u
+    LEFT JOIN likes l_sent ON l_sent.from_user_id = u.id
+    LEFT JOIN likes l_received ON l_received.to_user_id = u.id
+    LEFT JOIN skips s ON s.from_user_id = u.id
+    GROUP BY u.id
+    ORDER BY u.created_at DESC
+"""
+
+async def seed(conn, users, likes, skips):
+    """Отдельная схема с копией структуры и случайными данными"""
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"SET search_path TO {SCHEMA}")
+    await conn.execute("""
+        CREATE TABLE users (
+            id SERIAL PRIMARY KEY,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            interest_area TEXT,
+            expertise_area TEXT,
+            contact_tag VARCHAR(100),
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+        CREATE TABLE likes (
+            id SERIAL PRIMARY KEY,
+            from_user_id INTEGER REFERENCES users(id),
+            to_user_id INTEGER REFERENCES users(id),
+            created_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE(from_user_id, to_user_id)
+        );
+        CREATE TABLE skips (
+            id SERIAL PRIMARY KEY,
+            from_user_id INTEGER REFERENCES users(id),
+            to_user_id INTEGER REFERENCES users(id),
+            created_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE(from_user_id, to_user_id)
+        );
+        CREATE TABLE matches (
+            user1_id INTEGER NOT NULL REFERENCES users(id),
+            user2_id INTEGER NOT NULL REFERENCES users(id),
+            created_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (user1_id, user2_id),
+            CHECK (user1_id < user2_id)
+        );
+        CREATE INDEX matches_user2_idx ON matches (user2_id);
+        CREATE INDEX likes_to_user_created_idx ON likes (to_user_id, created_at DESC, id DESC);
+    """)
+    await conn.execute("""
+        INSERT INTO users (telegram_id, name, interest_area, expertise_area, created_at)
+        SELECT 1000000 + i, 'user' || i,
+               (ARRAY['Python', 'SQL', 'Дизайн', 'Маркетинг', 'ML', 'Go'])[1 + i % 6],
+               (ARRAY['Java', 'Python', 'Продажи', 'Финансы'])[1 + i % 4],
+               NOW() - (i || ' minutes')::interval
+        FROM generate_series(1, $1) i
+    """, users)
+    for table, count in (("likes", likes), ("skips", skips)):
+        await conn.execute(f"""
+            INSERT INTO {table} (from_user_id, to_user_id)
+            SELECT DISTINCT a, b FROM (
+                SELECT 1 + floor(random() * $1)::int AS a, 1 + floor(random() * $1)::int AS b
+                FROM generate_series(1, $2)
+            ) pairs
+            WHERE a <> b
+            ON CONFLICT DO NOTHING
+        """, users, count)
+    await conn.execute("""
+        INSERT INTO matches (user1_id, user2_id)
+        SELECT l1.from_user_id, l1.to_user_id
+        FROM likes l1
+        JOIN likes l2 ON l2.from_user_id = l1.to_user_id AND l2.to_user_id = l1.from_user_id
+        WHERE l1.from_user_id < l1.to_user_id
+    """)
+    await conn.execute("ANALYZE")
+
+
+async def measure(conn, query, repeat=3):
+    best = None
+    rows = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = await conn.fetch(query)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+async def run(users, likes, skips, repeat):
+    conn = await asyncpg.connect(os.getenv('DATABASE_URL'))
+    try:
+        print(f"🌱 Заполняю {SCHEMA}: {users} пользователей, ~{likes} лайков, ~{skips} пропусков...")
+        await seed(conn, users, likes, skips)
+
+        old_time, old_rows = await measure(conn, LEGACY_USER_STATS_QUERY, repeat=repeat)
+        new_time, new_rows = await measure(conn, USER_STATS_QUERY, repeat=repeat)
+        same = sorted(map(tuple, old_rows)) == sorted(map(tuple, new_rows))
+        print(
+            f"📊 CSV статистика: было {old_time * 1000:.0f} мс, стало {new_time * 1000:.0f} мс "
+            f"(x{old_time / new_time:.1f}), результаты {'совпадают' if same else 'РАЗЛИЧАЮТСЯ'}"
+        )
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение старых и новых запросов статистики")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--likes", type=int, default=50000)
+    parser.add_argument("--skips", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.likes, args.skips, args.repeat))
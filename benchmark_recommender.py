@@ -0,0 +1,62 @@
+import argparse
+import time
+
+import numpy as np
+
+from recommender import LikeGraph
+
+
+def synthetic_likes(users, likes_per_user, seed=42):
+    """Случайный граф лайков: популярность анкет по степенному закону"""
+    rng = np.random.default_rng(seed)
+    total = users * likes_per_user
+    from_ids = rng.integers(1, users + 1, size=total)
+    to_ids = np.minimum((rng.pareto(1.2, size=total) * users / 50).astype(np.int64) + 1, users)
+    # Перемешиваем id, чтобы популярные анкеты не шли подряд
+    to_ids = rng.permutation(users + 1)[to_ids]
+    to_ids[to_ids == 0] = 1
+    pairs = np.unique(np.stack([from_ids, to_ids], axis=1), axis=0)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return pairs[:, 0], pairs[:, 1]
+
+
+def run(users, likes_per_user, top_k, sample, block):
+    from_ids, to_ids = synthetic_likes(users, likes_per_user)
+    print(f"🌱 {users} пользователей, {len(from_ids)} лайков")
+
+    started = time.perf_counter()
+    graph = LikeGraph(from_ids, to_ids)
+    print(f"🧱 Граф собран за {time.perf_counter() - started:.2f} с")
+
+    picked = np.random.default_rng(7).choice(np.arange(1, users + 1), size=sample, replace=False)
+
+    started = time.perf_counter()
+    with_recs = 0
+    for user_id in picked:
+        ids, _ = graph.recommend([user_id], top_k)[int(user_id)]
+        with_recs += bool(len(ids))
+    elapsed = time.perf_counter() - started
+    print(
+        f"⚡ top-{top_k} по одному: {elapsed / sample * 1000:.2f} мс на пользователя, "
+        f"с рекомендациями: {with_recs} из {sample}"
+    )
+
+    started = time.perf_counter()
+    for i in range(0, sample, block):
+        graph.recommend(picked[i:i + block], top_k)
+    elapsed = time.perf_counter() - started
+    print(
+        f"📦 Пачками по {block}: {elapsed / sample * 1000:.2f} мс на пользователя, "
+        f"пересчет всех {users}: ~{elapsed / sample * users:.0f} с"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Скорость рекомендаций по графу лайков")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--likes-per-user", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--block", type=int, default=32)
+    args = parser.parse_args()
+    run(args.users, args.likes_per_user, args.top_k, args.sample, args.block)
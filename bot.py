@@ -1,23 +1,41 @@
 import asyncio
+import html
+from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from database import Database
 import config
-from admin import AdminTools
+from admin import UserStatsUpload
+from browse_queue import BrowseQueue
+from middlewares import UserMiddleware, RegisteredOnlyMiddleware
+from notifier import Notifier
+from storage import BoundedMemoryStorage, PostgresStorage
+from webhook import build_app, run_webhook, serve
 
 # Список админов (твой Telegram ID)
 ADMIN_IDS = [2085406957]  # Замени на свой ID
 
 # Инициализация
 bot = Bot(config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
 db = Database()
+if config.FSM_STORAGE == "postgres":
+    storage = PostgresStorage(db)
+else:
+    storage = BoundedMemoryStorage(ttl=config.FSM_TTL, max_keys=config.FSM_MAX_KEYS)
+dp = Dispatcher(storage=storage)
+browse_queue = BrowseQueue(db)
+notifier = Notifier(bot, rate=config.NOTIFY_RATE)
+
+# Профиль пользователя загружается один раз на апдейт, а хендлеры с флагом
+# registered получают его уже проверенным
+dp.update.outer_middleware(UserMiddleware(db))
+dp.message.middleware(RegisteredOnlyMiddleware())
+dp.callback_query.middleware(RegisteredOnlyMiddleware())
+REGISTERED = {"registered": True}
 
 # FSM состояния для регистрации
 class Registration(StatesGroup):
@@ -44,8 +62,7 @@ def get_main_keyboard():
 
 # Обработчики
 @dp.message(Command("start"))
-async def cmd_start(message: types.Message, state: FSMContext):
-    user = await db.get_user_by_tg(message.from_user.id)
+async def cmd_start(message: types.Message, state: FSMContext, user):
     if user:
         await message.answer(
             f"Привет, {user['name']}! 👋\n\n"
@@ -62,21 +79,21 @@ async def cmd_start(message: types.Message, state: FSMContext):
     await state.set_state(Registration.name)
 
 # Обработка основной клавиатуры
-@dp.message(F.text == "👀 Смотреть анкеты")
-async def handle_browse_button(message: types.Message):
-    await cmd_browse(message)
+@dp.message(F.text == "👀 Смотреть анкеты", flags=REGISTERED)
+async def handle_browse_button(message: types.Message, user):
+    await cmd_browse(message, user)
 
-@dp.message(F.text == "❤️ Мои лайки")
-async def handle_likes_button(message: types.Message):
-    await cmd_likes(message)
+@dp.message(F.text == "❤️ Мои лайки", flags=REGISTERED)
+async def handle_likes_button(message: types.Message, user):
+    await cmd_likes(message, user)
 
-@dp.message(F.text == "📊 Статистика")
-async def handle_stats_button(message: types.Message):
-    await cmd_stats(message)
+@dp.message(F.text == "📊 Статистика", flags=REGISTERED)
+async def handle_stats_button(message: types.Message, user):
+    await cmd_stats(message, user)
 
-@dp.message(F.text == "👤 Мой профиль")
-async def handle_profile_button(message: types.Message):
-    await cmd_profile(message)
+@dp.message(F.text == "👤 Мой профиль", flags=REGISTERED)
+async def handle_profile_button(message: types.Message, user):
+    await cmd_profile(message, user)
 
 # Регистрация
 @dp.message(Registration.name)
@@ -126,13 +143,8 @@ async def process_contact(message: types.Message, state: FSMContext):
     )
 
 # Команда профиля с кнопками редактирования
-@dp.message(Command("profile"))
-async def cmd_profile(message: types.Message):
-    user = await db.get_user_by_tg(message.from_user.id)
-    if not user:
-        await message.answer("Сначала зарегистрируйся - /start")
-        return
-    
+@dp.message(Command("profile"), flags=REGISTERED)
+async def cmd_profile(message: types.Message, user):
     text = (
         f"👤 <b>Твой профиль</b>\n\n"
         f"📝 Имя: {user['name']}\n"
@@ -195,28 +207,21 @@ async def handle_edit_value(message: types.Message, state: FSMContext):
     if updated_user:
         await message.answer(f"✅ {field_name.capitalize()} успешно обновлено!")
         # Показываем обновленный профиль
-        await cmd_profile(message)
+        await cmd_profile(message, updated_user)
     else:
         await message.answer("❌ Ошибка при обновлении профиля")
     
     await state.clear()
 
 # Лента анкет
-@dp.message(Command("browse"))
-async def cmd_browse(message: types.Message):
-    user = await db.get_user_by_tg(message.from_user.id)
-    if not user:
-        await message.answer("Сначала зарегистрируйся - /start")
-        return
+@dp.message(Command("browse"), flags=REGISTERED)
+async def cmd_browse(message: types.Message, user):
+    profile = await browse_queue.next_profile(user['id'])
     
-    profiles = await db.get_unseen_profiles(message.from_user.id, limit=1)
-    
-    if not profiles:
+    if not profile:
         await message.answer("🎉 Ты просмотрел все анкеты! Загляни позже.")
         return
     
-    profile = profiles[0]
-    
     text = (
         f"👤 <b>{profile['name']}</b>\n\n"
         f"🎯 Интересы: {profile['interest_area']}\n"
@@ -244,68 +249,72 @@ async def handle_main_menu(callback: types.CallbackQuery):
     await callback.answer()
 
 # Обработка лайка
-@dp.callback_query(F.data.startswith("like:"))
-async def cb_like(callback: types.CallbackQuery):
+@dp.callback_query(F.data.startswith("like:"), flags=REGISTERED)
+async def cb_like(callback: types.CallbackQuery, user):
     user_id = int(callback.data.split(":")[1])
     tg_user = callback.from_user
     
-    success, info = await db.save_like(tg_user.id, user_id)
+    success, info = await db.save_like(user['id'], user_id)
+    browse_queue.mark_seen(user['id'], user_id)
     
     if not success:
-        if info == "not_registered":
-            await callback.message.answer("Сначала зарегистрируйся - /start")
-        elif info == "already_liked":
+        if info == "already_liked":
             await callback.answer("Ты уже лайкал эту анкету")
         await callback.answer()
         return
     
     target_user = await db.get_user_by_id(user_id)
     
-    if target_user:
+    if target_user and info == "match":
         await callback.message.answer(
-            f"❤️ Ты лайкнул(а) {target_user['name']}!\n\n"
+            f"💫 Это взаимно! {target_user['name']} тоже лайкнул(а) тебя!\n\n"
             f"📱 Telegram: {target_user['contact_tag']}\n\n"
             f"💬 Напиши ему/ей и договорись о менторстве!",
             reply_markup=get_main_keyboard()
         )
         
-        await bot.send_message(
+        # Уведомление уходит через очередь, лайкнувший не ждет отправки
+        notifier.send(
             target_user['telegram_id'],
-            f"🎉 Твой профиль понравился {tg_user.full_name}!\n\n"
-            f"Теперь они могут написать тебе\n\n"
-            f"Посмотреть всех, кто тебя лайкнул - нажми '❤️ Мои лайки'"
+            f"💫 Взаимный лайк с {user['name']}!\n\n"
+            f"📱 Telegram: {user['contact_tag']}\n\n"
+            f"💬 Напиши и договоритесь о менторстве!"
+        )
+    elif target_user:
+        await callback.message.answer(
+            f"❤️ Ты лайкнул(а) {target_user['name']}!\n\n"
+            f"📱 Telegram: {target_user['contact_tag']}\n\n"
+            f"💬 Напиши ему/ей и договорись о менторстве!",
+            reply_markup=get_main_keyboard()
         )
+        
+        # Уведомление уходит через очередь, лайкнувший не ждет отправки
+        notifier.notify_like(target_user['telegram_id'], tg_user.full_name)
     
     await callback.answer("Лайк отправлен!")
 
 # Обработка пропуска - ИСПРАВЛЕННАЯ ВЕРСИЯ
-@dp.callback_query(F.data.startswith("skip:"))
-async def cb_skip(callback: types.CallbackQuery):
+@dp.callback_query(F.data.startswith("skip:"), flags=REGISTERED)
+async def cb_skip(callback: types.CallbackQuery, user):
     user_id = int(callback.data.split(":")[1])
     
     # Сохраняем пропуск
-    success = await db.save_skip(callback.from_user.id, user_id)
+    success = await db.save_skip(user['id'], user_id)
     
     if not success:
         await callback.answer("Ошибка: пользователь не найден")
         return
     
+    browse_queue.mark_seen(user['id'], user_id)
     await callback.answer("Пропущено")
     
     # Получаем следующую анкету
-    user = await db.get_user_by_tg(callback.from_user.id)
-    if not user:
-        await callback.message.edit_text("Сначала зарегистрируйся - /start")
-        return
-    
-    profiles = await db.get_unseen_profiles(callback.from_user.id, limit=1)
+    profile = await browse_queue.next_profile(user['id'])
     
-    if not profiles:
+    if not profile:
         await callback.message.edit_text("🎉 Ты просмотрел все анкеты! Загляни позже.")
         return
     
-    profile = profiles[0]
-    
     text = (
         f"👤 <b>{profile['name']}</b>\n\n"
         f"🎯 Интересы: {profile['interest_area']}\n"
@@ -324,16 +333,79 @@ async def cb_skip(callback: types.CallbackQuery):
     await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
 
 # Лайки
-@dp.message(Command("likes"))
-async def cmd_likes(message: types.Message):
-    user = await db.get_user_by_tg(message.from_user.id)
-    if not user:
-        await message.answer("Сначала зарегистрируйся - /start")
-        return
-    
-    likers = await db.get_likes_for_user(message.from_user.id)
+LIKES_PAGE_SIZE = 30
+# Лимит Telegram на длину сообщения (в UTF-16), с запасом
+MESSAGE_BUDGET = 4000
+_EPOCH = datetime(1970, 1, 1)
+
+def encode_like_cursor(row):
+    micros = (row['created_at'] - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}:{row['like_id']}"
+
+def decode_like_cursor(value):
+    micros, like_id = value.split(":")
+    return _EPOCH + timedelta(microseconds=int(micros)), int(like_id)
+
+def _utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+def render_likes_page(rows, newer, has_more_before, has_more_after):
+    """Собирает страницу лайков, укладываясь в лимит длины сообщения.
+
+    rows идут от курсора (как их вернула get_likes_page). Возвращает текст
+    и клавиатуру или (None, None), если строк нет.
+    """
+    header = "❤️ <b>Тебя лайкнули:</b>\n\n"
+    footer = "\n🎉 Напиши им и начни общение!"
+    budget = MESSAGE_BUDGET - _utf16_len(header) - _utf16_len(footer)
+
+    lines = []
+    for row in rows:
+        line = f"👤 {html.escape(row['name'])} - {html.escape(row['contact_tag'] or '')}\n"
+        budget -= _utf16_len(line)
+        if budget < 0:
+            break
+        lines.append(line)
+    if not lines:
+        return None, None
+
+    shown = rows[:len(lines)]
+    # Что-то не поместилось - за краем страницы есть еще лайки
+    cut = len(shown) < len(rows)
+    if newer:
+        shown.reverse()
+        lines.reverse()
+        has_newer, has_older = has_more_before or cut, has_more_after
+    else:
+        has_newer, has_older = has_more_before, has_more_after or cut
+
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Новее", callback_data=f"likes:newer:{encode_like_cursor(shown[0])}"
+        ))
+    if has_older:
+        buttons.append(InlineKeyboardButton(
+            text="Старше ➡️", callback_data=f"likes:older:{encode_like_cursor(shown[-1])}"
+        ))
+    kb = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+    return header + "".join(lines) + footer, kb
+
+async def load_likes_page(user_id, cursor=None, newer=False):
+    rows = await db.get_likes_page(user_id, cursor=cursor, newer=newer, limit=LIKES_PAGE_SIZE)
+    has_more = len(rows) > LIKES_PAGE_SIZE
+    rows = rows[:LIKES_PAGE_SIZE]
+    if newer:
+        # Листаем к новым: дальше курсора еще есть новее, а старше - точно есть
+        return render_likes_page(rows, True, has_more, True)
+    return render_likes_page(rows, False, cursor is not None, has_more)
+
+@dp.message(Command("likes"), flags=REGISTERED)
+async def cmd_likes(message: types.Message, user):
+    text, kb = await load_likes_page(user['id'])
     
-    if not likers:
+    if not text:
         await message.answer(
             "😔 Пока никто не лайкнул твой профиль\n\n"
             "Продолжай смотреть анкеты!",
@@ -341,38 +413,81 @@ async def cmd_likes(message: types.Message):
         )
         return
     
-    text = "❤️ <b>Тебя лайкнули:</b>\n\n"
-    for liker in likers:
-        text += f"👤 {liker['name']} - {liker['contact_tag']}\n"
+    await message.answer(text, parse_mode="HTML", reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("likes:"), flags=REGISTERED)
+async def cb_likes_page(callback: types.CallbackQuery, user):
+    _, direction, cursor = callback.data.split(":", 2)
+    text, kb = await load_likes_page(
+        user['id'], cursor=decode_like_cursor(cursor), newer=(direction == "newer")
+    )
     
-    text += "\n🎉 Напиши им и начни общение!"
+    if not text:
+        await callback.answer("Больше лайков нет")
+        return
     
-    await message.answer(text, parse_mode="HTML")
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+    await callback.answer()
 
 # Статистика
-@dp.message(Command("stats"))
-async def cmd_stats(message: types.Message):
-    user = await db.get_user_by_tg(message.from_user.id)
-    if not user:
-        await message.answer("Сначала зарегистрируйся - /start")
-        return
-    
-    likers = await db.get_likes_for_user(message.from_user.id)
-    mutual = await db.get_mutual_likes(message.from_user.id)
+@dp.message(Command("stats"), flags=REGISTERED)
+async def cmd_stats(message: types.Message, user):
+    stats = await db.get_user_stats(user['id'])
     
     text = (
         f"📊 <b>Твоя статистика</b>\n\n"
-        f"❤️ Тебя лайкнули: {len(likers)} чел.\n"
-        f"💫 Взаимные лайки: {len(mutual)} чел.\n\n"
+        f"❤️ Тебя лайкнули: {stats['likes_received']} чел.\n"
+        f"💫 Взаимные лайки: {stats['mutual_likes']} чел.\n\n"
         f"Продолжай в том же духе! 🚀"
     )
     
     await message.answer(text, parse_mode="HTML", reply_markup=get_main_keyboard())
 
+async def notify_buffered_match(from_user_id, to_user_id):
+    """Взаимный лайк, найденный при записи отложенных свайпов: в момент
+    лайка встречный еще лежал в буфере другого процесса, и никто из двоих
+    не узнал о взаимности"""
+    first = await db.get_user_by_id(from_user_id)
+    second = await db.get_user_by_id(to_user_id)
+    if not first or not second:
+        return
+    for user, other in ((first, second), (second, first)):
+        notifier.send(
+            user['telegram_id'],
+            f"💫 Взаимный лайк с {other['name']}!\n\n"
+            f"📱 Telegram: {other['contact_tag']}\n\n"
+            f"💬 Напиши и договоритесь о менторстве!"
+        )
+
 async def main():
     await db.create_pool()
+    if db.swipes:
+        db.swipes.on_match = notify_buffered_match
+    if config.FSM_STORAGE == "postgres":
+        await storage.start()
+    notifier.start()
     print("Бот запущен с исправленным пропуском! 🚀")
-    await dp.start_polling(bot)
+    try:
+        if config.DELIVERY_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                url=config.WEBHOOK_URL,
+                path=config.WEBHOOK_PATH,
+                secret=config.WEBHOOK_SECRET,
+                host=config.WEB_HOST,
+                port=config.WEB_PORT
+            )
+        elif config.DELIVERY_MODE == "worker":
+            # Апдейты приходят от supervisor.py, вебхук устанавливает он
+            app = build_app(dp, bot, config.WEBHOOK_PATH, config.WEBHOOK_SECRET)
+            await serve(app, config.WEB_HOST, config.WEB_PORT)
+        else:
+            # Telegram не отдает апдейты через getUpdates, пока установлен вебхук
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await notifier.stop()
+        await db.close()
 
 @dp.message(Command("admin"))
 async def cmd_admin(message: types.Message):
@@ -401,14 +516,14 @@ async def handle_admin_csv(callback: types.CallbackQuery):
     await callback.message.answer("⏳ Формирую CSV отчет...")
     
     try:
-        filename, count = await AdminTools.get_user_stats_csv()
-        
-        # Отправляем файл
-        with open(filename, 'rb') as f:
-            await callback.message.answer_document(
-                types.BufferedInputFile(f.read(), filename=filename),
-                caption=f"📊 Отчет: {count} пользователей"
-            )
+        # Файл идет потоком, и число строк известно только после отправки -
+        # для подписи считаем пользователей заранее (одна строка на каждого)
+        async with db.connection() as conn:
+            count = await conn.fetchval("SELECT COUNT(*) FROM users")
+        await callback.message.answer_document(
+            UserStatsUpload(db),
+            caption=f"📊 Отчет: {count} пользователей"
+        )
         
         await callback.answer("✅ Файл отправлен")
         
@@ -433,12 +548,22 @@ async def handle_admin_stats(callback: types.CallbackQuery):
             WHERE created_at >= CURRENT_DATE
         """)
     
+    seen = db.seen_index.memory_report()
+    cache = db.user_cache.stats()
+    fsm = storage.stats()
+    
     text = (
         "📈 **Общая статистика:**\n\n"
         f"👥 Пользователей: {total_users}\n"
         f"❤️ Всего лайков: {total_likes}\n"
         f"➡️ Всего пропусков: {total_skips}\n"
         f"🎯 Активных сегодня: {active_today}\n"
+        f"🧠 Индекс просмотров: {seen['users_loaded']} польз., "
+        f"{seen['total_bytes'] // 1024} КБ (~{seen['bytes_per_10k_users'] // 1024} КБ на 10k)\n"
+        f"👤 Кэш профилей: {cache['size']} записей, попаданий {cache['hits']}, "
+        f"промахов {cache['misses']} ({cache['hit_rate']:.0%})\n"
+        f"📝 FSM: {', '.join(f'{k} {v}' for k, v in fsm.items())}\n"
+        f"👁 Показы: {', '.join(f'{k} {v}' for k, v in db.exposure.stats().items())}\n"
         f"📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
     )
     
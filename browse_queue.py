@@ -0,0 +1,113 @@
+import asyncio
+from collections import OrderedDict, deque
+
+
+class _UserQueue:
+    def __init__(self):
+        self.items = deque()      # профили, готовые к показу
+        self.queued_ids = set()   # id профилей в очереди
+        self.seen_ids = set()     # лайкнутые/пропущенные за время жизни очереди
+        self.shown_ids = set()    # показанные, но еще без реакции
+        self.exhausted = False    # база вернула меньше пачки - фоном не догружаем
+        self.refill_task = None
+
+
+class BrowseQueue:
+    """Очередь анкет для ленты.
+
+    Подгружает пачку непросмотренных профилей из базы и отдает их по одному
+    из памяти, фоном догружая новую пачку, когда очередь заканчивается.
+    """
+
+    def __init__(self, db, batch_size=20, low_watermark=5, max_users=5000):
+        self.db = db
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.max_users = max_users
+        self._queues = OrderedDict()
+
+    def _get_queue(self, user_id):
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = _UserQueue()
+            self._queues[user_id] = queue
+            # Выкидываем самых давно неактивных пользователей
+            while len(self._queues) > self.max_users:
+                _, old = self._queues.popitem(last=False)
+                if old.refill_task and not old.refill_task.done():
+                    old.refill_task.cancel()
+        else:
+            self._queues.move_to_end(user_id)
+        return queue
+
+    async def _refill(self, user_id, queue):
+        profiles = await self.db.get_unseen_profiles(user_id, limit=self.batch_size)
+        queue.exhausted = len(profiles) < self.batch_size
+
+        fresh = [
+            p for p in profiles
+            if p['id'] not in queue.seen_ids and p['id'] not in queue.queued_ids
+        ]
+        candidates = [p for p in fresh if p['id'] not in queue.shown_ids]
+
+        # Если база вернула только уже показанные анкеты - показываем их повторно
+        if not candidates and not queue.items and fresh:
+            queue.shown_ids.clear()
+            candidates = fresh
+
+        for profile in candidates:
+            queue.items.append(profile)
+            queue.queued_ids.add(profile['id'])
+
+    async def _background_refill(self, user_id, queue):
+        try:
+            await self._refill(user_id, queue)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Ошибка при подгрузке анкет для пользователя {user_id}: {e}")
+
+    def _schedule_refill(self, user_id, queue):
+        if queue.refill_task and not queue.refill_task.done():
+            return
+        queue.refill_task = asyncio.create_task(self._background_refill(user_id, queue))
+
+    async def next_profile(self, user_id):
+        """Следующая анкета для показа или None, если смотреть больше некого"""
+        queue = self._get_queue(user_id)
+
+        if not queue.items:
+            # Очередь пуста - дожидаемся текущей подгрузки или грузим сами
+            if queue.refill_task and not queue.refill_task.done():
+                await queue.refill_task
+            if not queue.items:
+                await self._refill(user_id, queue)
+
+        profile = None
+        while queue.items:
+            candidate = queue.items.popleft()
+            queue.queued_ids.discard(candidate['id'])
+            if candidate['id'] not in queue.seen_ids:
+                profile = candidate
+                break
+
+        if profile:
+            queue.shown_ids.add(profile['id'])
+            self.db.exposure.record(profile['id'])
+
+        if len(queue.items) < self.low_watermark and not queue.exhausted:
+            self._schedule_refill(user_id, queue)
+
+        return profile
+
+    def mark_seen(self, user_id, profile_id):
+        """Убирает из очереди анкету, которую пользователь лайкнул или пропустил"""
+        queue = self._queues.get(user_id)
+        if queue is None:
+            return
+
+        queue.seen_ids.add(profile_id)
+        queue.shown_ids.discard(profile_id)
+        if profile_id in queue.queued_ids:
+            queue.queued_ids.discard(profile_id)
+            queue.items = deque(p for p in queue.items if p['id'] != profile_id)
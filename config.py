@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,9 +8,69 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Стратегия выборки анкет для ленты: "keyset" (случайные точки по индексу id),
+# "ranked" (по взаимодополняемости навыков), "collaborative" (по графу
+# лайков) или "random" (старый ORDER BY RANDOM(), для сравнения)
+PROFILE_SAMPLING = os.getenv("PROFILE_SAMPLING", "keyset")
+# Сколько лучших кандидатов держать в кэше ранжирования на пользователя
+RANKER_TOP_K = int(os.getenv("RANKER_TOP_K", "200"))
+RECOMMENDER_TOP_K = int(os.getenv("RECOMMENDER_TOP_K", "100"))
+
+# Выравнивание показов: доля мест в пачке для наименее показанных анкет
+# (0 - выключено) и во сколько раз больше среднего показов считается перебором
+FAIRNESS_BUDGET = float(os.getenv("FAIRNESS_BUDGET", "0.3"))
+EXPOSURE_CAP = float(os.getenv("EXPOSURE_CAP", "3.0"))
+EXPOSURE_FLUSH_INTERVAL = float(os.getenv("EXPOSURE_FLUSH_INTERVAL", "30"))
+
+# Инкрементальная выгрузка (uploader.py): полный снимок каждые N запусков,
+# между ними - только новые и измененные строки. Строки моложе EXPORT_LAG
+# секунд ждут следующего запуска: их транзакции могут быть еще не закоммичены
+EXPORT_SNAPSHOT_EVERY = int(os.getenv("EXPORT_SNAPSHOT_EVERY", "7"))
+EXPORT_LAG = int(os.getenv("EXPORT_LAG", "60"))
+
+# Индекс просмотренных анкет в памяти бота
+SEEN_INDEX_MAX_MB = int(os.getenv("SEEN_INDEX_MAX_MB", "64"))
+SEEN_INDEX_IDLE_SECONDS = int(os.getenv("SEEN_INDEX_IDLE_SECONDS", "3600"))
+
+# Кэш профилей по telegram_id
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+
+# Отложенная пакетная запись лайков и пропусков
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0"))
+
+# Хранилище состояний FSM: "postgres" (переживает рестарт, общее для
+# процессов) или "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+# Для "memory": сколько живет брошенная регистрация и сколько ключей держим
+FSM_TTL = int(os.getenv("FSM_TTL", "86400"))
+FSM_MAX_KEYS = int(os.getenv("FSM_MAX_KEYS", "50000"))
+
+# Получение апдейтов: "polling" или "webhook"
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://bot.up.railway.app
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Если секрет не задан, генерируем новый при каждом запуске - вебхук все равно
+# переустанавливается на старте
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+
+# supervisor.py: число процессов-воркеров и порты, на которых они слушают
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8081"))
+
+# Общий лимит Telegram на рассылку делится между воркерами
+NOTIFY_RATE = 30 / WORKERS if DELIVERY_MODE == "worker" else 30
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен")
 
+if DELIVERY_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("WEBHOOK_URL не установлен для режима webhook")
+
 # Автоматически создаем таблицы при первом запуске
 if not DATABASE_URL:
     print("⚠️ DATABASE_URL не установлен, проверь переменные окружения")
@@ -1,77 +1,653 @@
 import asyncpg
 import config
 import ssl
-from datetime import datetime
+import random
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from exposure import ExposureTracker, FairScheduler
+from aggregation import USER_COUNTERS_QUERY
+from cache import TTLCache
+from ranker import SkillRanker
+from recommender import LikeRecommender
+from seen_index import SeenIndex
+from tags import normalize_tag, profile_tags
+from write_buffer import SwipeBuffer
+
+# Соединение, взятое текущей задачей: вложенные вызовы Database
+# переиспользуют его вместо того, чтобы брать второе из пула
+_current_conn = ContextVar('current_conn', default=None)
+
+# Версия схемы в create_tables: увеличивать при каждой правке DDL, иначе
+# уже размеченные базы изменений не получат
+SCHEMA_VERSION = 3
+# Ключ pg_advisory_xact_lock, под которым один процесс обновляет схему
+MIGRATION_LOCK_KEY = 72610001
 
 class Database:
     def __init__(self):
         self.pool = None
+        self.seen_index = SeenIndex(
+            self,
+            max_bytes=config.SEEN_INDEX_MAX_MB * 1024 * 1024,
+            idle_seconds=config.SEEN_INDEX_IDLE_SECONDS
+        )
+        # Профили по telegram_id; незарегистрированные не кэшируются
+        self.user_cache = TTLCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+        # Ранжирование ленты по навыкам (PROFILE_SAMPLING=ranked)
+        self.ranker = SkillRanker(self, top_k=config.RANKER_TOP_K)
+        # Рекомендации по графу лайков (PROFILE_SAMPLING=collaborative)
+        self.recommender = LikeRecommender(self, top_k=config.RECOMMENDER_TOP_K)
+        # Показы анкет и выравнивание ленты по ним
+        self.exposure = ExposureTracker(self, flush_interval=config.EXPOSURE_FLUSH_INTERVAL)
+        self.scheduler = FairScheduler(
+            self.exposure,
+            budget=config.FAIRNESS_BUDGET,
+            cap=config.EXPOSURE_CAP
+        )
+        # Буфер свайпов для режима отложенной записи (WRITE_BEHIND=1)
+        self.swipes = None
+        if config.WRITE_BEHIND:
+            self.swipes = SwipeBuffer(
+                self,
+                max_batch=config.WRITE_BEHIND_BATCH,
+                flush_interval=config.WRITE_BEHIND_INTERVAL
+            )
+
+    @staticmethod
+    def _ssl_context():
+        # SSL контекст для Neon
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+        return ssl_context
+
+    async def connect(self):
+        """Отдельное соединение вне пула (для долгих LISTEN)"""
+        return await asyncpg.connect(config.DATABASE_URL, ssl=self._ssl_context())
 
     async def create_pool(self):
         try:
-            # SSL контекст для Neon
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            
             # Подключаемся с SSL
             self.pool = await asyncpg.create_pool(
                 config.DATABASE_URL,
-                ssl=ssl_context,
+                ssl=self._ssl_context(),
                 min_size=1,
                 max_size=10
             )
             
             # Принудительно создаем таблицы при каждом подключении
             await self.create_tables()
+            await self.exposure.start()
+            if self.swipes:
+                self.swipes.start()
+            if config.PROFILE_SAMPLING == "ranked":
+                # Индекс анкет собирается несколько секунд - начинаем сразу,
+                # а до готовности лента идет по keyset
+                self.ranker.warm()
             print("✅ Подключение к базе установлено с SSL")
             
         except Exception as e:
             print(f"❌ Ошибка подключения: {e}")
             raise
 
-    async def create_tables(self):
+    async def close(self):
+        """Дописывает отложенные свайпы и показы и закрывает пул"""
+        if self.swipes:
+            await self.swipes.stop()
+        await self.exposure.stop()
+        await self.ranker.stop()
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        """Соединение из пула; внутри блока все методы Database работают через него"""
+        conn = _current_conn.get()
+        if conn is not None:
+            yield conn
+            return
+
         async with self.pool.acquire() as conn:
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    name VARCHAR(100) NOT NULL,
-                    interest_area TEXT,
-                    expertise_area TEXT,
-                    contact_tag VARCHAR(100),
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
+            token = _current_conn.set(conn)
+            try:
+                yield conn
+            finally:
+                _current_conn.reset(token)
 
-                CREATE TABLE IF NOT EXISTS likes (
-                    id SERIAL PRIMARY KEY,
-                    from_user_id INTEGER REFERENCES users(id),
-                    to_user_id INTEGER REFERENCES users(id),
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    UNIQUE(from_user_id, to_user_id)
-                );
+    async def _schema_version(self, conn):
+        try:
+            return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        except asyncpg.UndefinedTableError:
+            return 0
+
+    async def create_tables(self):
+        """Создает и обновляет схему, если она старее SCHEMA_VERSION.
+
+        DDL (функции, триггеры, ALTER TABLE) берет эксклюзивные блокировки
+        на users/likes/skips, поэтому на уже размеченной базе ничего не
+        выполняется. Миграцию делает один процесс под advisory-блокировкой:
+        воркеры supervisor.py стартуют одновременно, и параллельный
+        CREATE OR REPLACE FUNCTION падает с "tuple concurrently updated".
+        """
+        async with self.connection() as conn:
+            if await self._schema_version(conn) >= SCHEMA_VERSION:
+                return
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_KEY)
+                await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+                # Пока ждали блокировку, схему мог обновить другой процесс
+                if await self._schema_version(conn) >= SCHEMA_VERSION:
+                    return
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        id SERIAL PRIMARY KEY,
+                        telegram_id BIGINT UNIQUE NOT NULL,
+                        name VARCHAR(100) NOT NULL,
+                        interest_area TEXT,
+                        expertise_area TEXT,
+                        contact_tag VARCHAR(100),
+                        created_at TIMESTAMP DEFAULT NOW()
+                    );
 
-                CREATE TABLE IF NOT EXISTS skips (
-                    id SERIAL PRIMARY KEY,
-                    from_user_id INTEGER REFERENCES users(id),
-                    to_user_id INTEGER REFERENCES users(id),
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    UNIQUE(from_user_id, to_user_id)
+                    CREATE TABLE IF NOT EXISTS likes (
+                        id SERIAL PRIMARY KEY,
+                        from_user_id INTEGER REFERENCES users(id),
+                        to_user_id INTEGER REFERENCES users(id),
+                        created_at TIMESTAMP DEFAULT NOW(),
+                        UNIQUE(from_user_id, to_user_id)
+                    );
+
+                    CREATE TABLE IF NOT EXISTS skips (
+                        id SERIAL PRIMARY KEY,
+                        from_user_id INTEGER REFERENCES users(id),
+                        to_user_id INTEGER REFERENCES users(id),
+                        created_at TIMESTAMP DEFAULT NOW(),
+                        UNIQUE(from_user_id, to_user_id)
+                    );
+
+                    -- Постраничный список "кто меня лайкнул"
+                    CREATE INDEX IF NOT EXISTS likes_to_user_created_idx
+                        ON likes (to_user_id, created_at DESC, id DESC);
+
+                    -- Состояния FSM (регистрация, редактирование профиля)
+                    CREATE TABLE IF NOT EXISTS fsm_storage (
+                        bot_id BIGINT NOT NULL,
+                        chat_id BIGINT NOT NULL,
+                        user_id BIGINT NOT NULL,
+                        thread_id BIGINT NOT NULL DEFAULT 0,
+                        destiny TEXT NOT NULL,
+                        state TEXT,
+                        data JSONB NOT NULL DEFAULT '{}',
+                        updated_at TIMESTAMP DEFAULT NOW(),
+                        PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+                    );
+
+                    -- Время последней правки анкеты: по нему выгружаются
+                    -- измененные профили (uploader.DataUploader)
+                    ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+                    CREATE INDEX IF NOT EXISTS users_updated_idx ON users (updated_at);
+                    CREATE INDEX IF NOT EXISTS users_created_idx ON users (created_at);
+                    CREATE INDEX IF NOT EXISTS likes_created_idx ON likes (created_at);
+                    CREATE INDEX IF NOT EXISTS skips_created_idx ON skips (created_at);
+
+                    -- До какого момента каждый поток уже выгружен
+                    CREATE TABLE IF NOT EXISTS export_watermarks (
+                        stream TEXT PRIMARY KEY,
+                        exported_until TIMESTAMP NOT NULL,
+                        deltas_since_snapshot INTEGER NOT NULL DEFAULT 0,
+                        snapshot_at TIMESTAMP,
+                        rows_exported BIGINT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT NOW()
+                    );
+
+                    -- Сколько раз анкету показывали в ленте
+                    CREATE TABLE IF NOT EXISTS profile_exposure (
+                        profile_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                        impressions BIGINT NOT NULL DEFAULT 0,
+                        last_shown_at TIMESTAMP
+                    );
+                """)
+                await self._create_counters(conn)
+                await self._create_activity(conn)
+                await self._create_tags(conn)
+                await conn.execute("DELETE FROM schema_version")
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", SCHEMA_VERSION)
+            print("✅ Таблицы созданы/проверены")
+
+    async def _create_counters(self, conn):
+        # Счетчики пользователя и взаимные лайки обновляются триггерами при
+        # вставке в likes/skips, поэтому статистика - это одно чтение по
+        # первичному ключу
+        matches_created = await conn.fetchval("SELECT to_regclass('matches') IS NULL")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS matches (
+                user1_id INTEGER NOT NULL REFERENCES users(id),
+                user2_id INTEGER NOT NULL REFERENCES users(id),
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (user1_id, user2_id),
+                CHECK (user1_id < user2_id)
+            );
+            CREATE INDEX IF NOT EXISTS matches_user2_idx ON matches (user2_id);
+
+            CREATE TABLE IF NOT EXISTS user_counters (
+                user_id INTEGER PRIMARY KEY REFERENCES users(id),
+                likes_sent INTEGER NOT NULL DEFAULT 0,
+                likes_received INTEGER NOT NULL DEFAULT 0,
+                mutual_likes INTEGER NOT NULL DEFAULT 0,
+                skips INTEGER NOT NULL DEFAULT 0
+            );
+
+            CREATE OR REPLACE FUNCTION update_like_counters() RETURNS trigger AS $$
+            DECLARE
+                mutual INTEGER := 0;
+            BEGIN
+                -- Сначала счетчики, обе строки одним запросом по возрастанию
+                -- user_id: лайки по кругу (A->B, B->C, C->A) иначе блокируют
+                -- их в разном порядке и ловят deadlock. Блокировка пары идет
+                -- после счетчиков - в том же порядке, что и у пакетной записи
+                -- (SwipeBuffer), которая заранее блокирует счетчики всей пачки
+                INSERT INTO user_counters (user_id, likes_sent, likes_received)
+                SELECT * FROM (VALUES
+                    (NEW.from_user_id, 1, 0),
+                    (NEW.to_user_id, 0, 1)
+                ) AS v(user_id, likes_sent, likes_received)
+                ORDER BY user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    likes_sent = user_counters.likes_sent + EXCLUDED.likes_sent,
+                    likes_received = user_counters.likes_received + EXCLUDED.likes_received;
+
+                -- Лайки одной пары из параллельных транзакций проверяются по
+                -- очереди, иначе обе могут не увидеть друг друга
+                PERFORM pg_advisory_xact_lock(
+                    LEAST(NEW.from_user_id, NEW.to_user_id),
+                    GREATEST(NEW.from_user_id, NEW.to_user_id)
                 );
+                IF EXISTS (
+                    SELECT 1 FROM likes l
+                    WHERE l.from_user_id = NEW.to_user_id
+                      AND l.to_user_id = NEW.from_user_id
+                ) THEN
+                    -- Пара записывается один раз, даже если оба лайка легли
+                    -- одним пакетом и триггер увидел взаимность дважды
+                    INSERT INTO matches (user1_id, user2_id)
+                    VALUES (LEAST(NEW.from_user_id, NEW.to_user_id),
+                            GREATEST(NEW.from_user_id, NEW.to_user_id))
+                    ON CONFLICT DO NOTHING;
+                    GET DIAGNOSTICS mutual = ROW_COUNT;
+                END IF;
+
+                IF mutual > 0 THEN
+                    -- Обе строки уже заблокированы этой транзакцией
+                    UPDATE user_counters SET mutual_likes = mutual_likes + 1
+                    WHERE user_id IN (NEW.from_user_id, NEW.to_user_id);
+                END IF;
+
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION update_skip_counters() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO user_counters (user_id, skips)
+                VALUES (NEW.from_user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET skips = user_counters.skips + 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS likes_counters ON likes;
+            CREATE TRIGGER likes_counters AFTER INSERT ON likes
+                FOR EACH ROW EXECUTE FUNCTION update_like_counters();
+
+            DROP TRIGGER IF EXISTS skips_counters ON skips;
+            CREATE TRIGGER skips_counters AFTER INSERT ON skips
+                FOR EACH ROW EXECUTE FUNCTION update_skip_counters();
+        """)
+
+        # Первый запуск на уже заполненной базе - заполняем производные таблицы
+        if matches_created:
+            await self.backfill_matches()
+        needs_backfill = await conn.fetchval("""
+            SELECT NOT EXISTS (SELECT 1 FROM user_counters)
+               AND (EXISTS (SELECT 1 FROM likes) OR EXISTS (SELECT 1 FROM skips))
+        """)
+        if needs_backfill:
+            await self.rebuild_counters()
+
+    async def _create_activity(self, conn):
+        # Сводка активности по дням. Триггеры на каждую вставку (одна запись
+        # на запрос, а не на строку) дописывают приращения в
+        # daily_activity_delta: только вставки, без общей строки дня, которую
+        # иначе блокировал бы каждый свайп до конца своей транзакции.
+        # Приращения сворачиваются в daily_activity при чтении
+        # (fold_activity), прошедшие дни один раз пересчитываются по базовым
+        # таблицам и помечаются finalized. daily_active_users нужна только
+        # чтобы считать уникальных активных за незакрытые дни и очищается
+        # при закрытии
+        activity_created = await conn.fetchval("SELECT to_regclass('daily_activity') IS NULL")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_activity (
+                day DATE PRIMARY KEY,
+                new_users INTEGER NOT NULL DEFAULT 0,
+                likes INTEGER NOT NULL DEFAULT 0,
+                skips INTEGER NOT NULL DEFAULT 0,
+                active_users INTEGER NOT NULL DEFAULT 0,
+                finalized BOOLEAN NOT NULL DEFAULT FALSE
+            );
+
+            CREATE TABLE IF NOT EXISTS daily_activity_delta (
+                day DATE NOT NULL,
+                new_users INTEGER NOT NULL DEFAULT 0,
+                likes INTEGER NOT NULL DEFAULT 0,
+                skips INTEGER NOT NULL DEFAULT 0,
+                active_users INTEGER NOT NULL DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS daily_active_users (
+                day DATE NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (day, user_id)
+            );
+
+            CREATE OR REPLACE FUNCTION rollup_new_users() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO daily_activity_delta (day, new_users)
+                SELECT created_at::date, COUNT(*) FROM new_rows GROUP BY 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION rollup_swipes() RETURNS trigger AS $$
+            DECLARE
+                is_like BOOLEAN := TG_TABLE_NAME = 'likes';
+            BEGIN
+                WITH first_today AS (
+                    INSERT INTO daily_active_users (day, user_id)
+                    SELECT DISTINCT created_at::date, from_user_id FROM new_rows
+                    ON CONFLICT DO NOTHING
+                    RETURNING day
+                ),
+                active AS (
+                    SELECT day, COUNT(*) AS n FROM first_today GROUP BY day
+                ),
+                swipes AS (
+                    SELECT created_at::date AS day, COUNT(*) AS n FROM new_rows GROUP BY 1
+                )
+                INSERT INTO daily_activity_delta (day, likes, skips, active_users)
+                SELECT s.day,
+                       CASE WHEN is_like THEN s.n ELSE 0 END,
+                       CASE WHEN is_like THEN 0 ELSE s.n END,
+                       COALESCE(a.n, 0)
+                FROM swipes s
+                LEFT JOIN active a ON a.day = s.day;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS users_activity ON users;
+            CREATE TRIGGER users_activity AFTER INSERT ON users
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION rollup_new_users();
+
+            DROP TRIGGER IF EXISTS likes_activity ON likes;
+            CREATE TRIGGER likes_activity AFTER INSERT ON likes
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION rollup_swipes();
+
+            DROP TRIGGER IF EXISTS skips_activity ON skips;
+            CREATE TRIGGER skips_activity AFTER INSERT ON skips
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION rollup_swipes();
+        """)
+
+        if activity_created:
+            has_events = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM users)")
+            if has_events:
+                await self.rebuild_activity()
+
+    async def backfill_matches(self):
+        """Заполняет matches по уже существующим взаимным лайкам"""
+        async with self.connection() as conn:
+            async with conn.transaction():
+                await conn.execute("LOCK TABLE likes IN SHARE MODE")
+                status = await conn.execute("""
+                    INSERT INTO matches (user1_id, user2_id, created_at)
+                    SELECT l1.from_user_id, l1.to_user_id, GREATEST(l1.created_at, l2.created_at)
+                    FROM likes l1
+                    JOIN likes l2 ON l1.from_user_id = l2.to_user_id AND l1.to_user_id = l2.from_user_id
+                    WHERE l1.from_user_id < l1.to_user_id
+                    ON CONFLICT DO NOTHING
+                """)
+            count = int(status.split()[-1])
+            print(f"✅ Взаимных пар добавлено: {count}")
+            return count
+
+    async def rebuild_counters(self):
+        """Пересчитывает user_counters по likes и skips.
+
+        Нужен после ручных правок (удаления лайков, TRUNCATE), которые
+        триггеры не отслеживают.
+        """
+        async with self.connection() as conn:
+            async with conn.transaction():
+                # Блокируем запись свайпов, чтобы не потерять вставки во время пересчета
+                await conn.execute("LOCK TABLE likes, skips IN SHARE MODE")
+                await conn.execute("DELETE FROM user_counters")
+                status = await conn.execute(
+                    "INSERT INTO user_counters (user_id, likes_sent, likes_received, mutual_likes, skips) "
+                    + USER_COUNTERS_QUERY
+                )
+                count = int(status.split()[-1])
+            print(f"✅ Счетчики пересчитаны для {count} пользователей")
+            return count
+
+    async def _create_tags(self, conn):
+        # Нормализованные навыки из interest_area/expertise_area и обратный
+        # индекс тег -> пользователи (первичный ключ user_tags)
+        tags_created = await conn.fetchval("SELECT to_regclass('user_tags') IS NULL")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS tags (
+                id SERIAL PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS user_tags (
+                tag_id INTEGER NOT NULL REFERENCES tags(id),
+                kind TEXT NOT NULL CHECK (kind IN ('interest', 'expertise')),
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                PRIMARY KEY (tag_id, kind, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS user_tags_user_idx ON user_tags (user_id);
+        """)
+        if tags_created:
+            has_users = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM users)")
+            if has_users:
+                await self.rebuild_tags()
+
+    async def _save_tags(self, conn, profiles):
+        """Заменяет теги пользователей; profiles - записи с id, interest_area, expertise_area"""
+        user_ids = []
+        names = []
+        kinds = []
+        for profile in profiles:
+            for tag, kind in profile_tags(profile['interest_area'], profile['expertise_area']):
+                user_ids.append(profile['id'])
+                names.append(tag)
+                kinds.append(kind)
+
+        async with conn.transaction():
+            await conn.execute(
+                "DELETE FROM user_tags WHERE user_id = ANY($1::int[])",
+                [profile['id'] for profile in profiles]
+            )
+            if not names:
+                return
+            await conn.execute("""
+                INSERT INTO tags (name)
+                SELECT DISTINCT unnest($1::text[])
+                ON CONFLICT (name) DO NOTHING
+            """, names)
+            await conn.execute("""
+                INSERT INTO user_tags (tag_id, kind, user_id)
+                SELECT t.id, x.kind, x.user_id
+                FROM unnest($1::int[], $2::text[], $3::text[]) AS x(user_id, name, kind)
+                JOIN tags t ON t.name = x.name
+                ON CONFLICT DO NOTHING
+            """, user_ids, names, kinds)
+
+    async def rebuild_tags(self, batch_size=1000):
+        """Заново строит user_tags по всем анкетам"""
+        count = 0
+        last_id = 0
+        async with self.connection() as conn:
+            while True:
+                profiles = await conn.fetch("""
+                    SELECT id, interest_area, expertise_area FROM users
+                    WHERE id > $1 ORDER BY id LIMIT $2
+                """, last_id, batch_size)
+                if not profiles:
+                    break
+                await self._save_tags(conn, profiles)
+                count += len(profiles)
+                last_id = profiles[-1]['id']
+        print(f"✅ Теги пересчитаны для {count} пользователей")
+        return count
+
+    async def find_users_by_tag(self, tag, kind=None, limit=50):
+        """Анкеты с навыком tag (kind: 'interest', 'expertise' или оба)"""
+        tag = normalize_tag(tag)
+        if not tag:
+            return []
+        async with self.connection() as conn:
+            rows = await conn.fetch("""
+                SELECT DISTINCT u.id, u.telegram_id, u.name, u.interest_area,
+                       u.expertise_area, u.contact_tag
+                FROM tags t
+                JOIN user_tags ut ON ut.tag_id = t.id
+                JOIN users u ON u.id = ut.user_id
+                WHERE t.name = $1 AND ($2::text IS NULL OR ut.kind = $2)
+                ORDER BY u.id
+                LIMIT $3
+            """, tag, kind, limit)
+            return [dict(row) for row in rows]
+
+    async def _recompute_activity(self, conn, start, end):
+        """Пересчитывает daily_activity за [start, end) по базовым таблицам"""
+        status = await conn.execute("""
+            WITH events AS (
+                SELECT created_at::date AS day, 1 AS new_users, 0 AS likes, 0 AS skips,
+                       NULL::integer AS user_id
+                FROM users WHERE created_at >= $1 AND created_at < $2
+                UNION ALL
+                SELECT created_at::date, 0, 1, 0, from_user_id
+                FROM likes WHERE created_at >= $1 AND created_at < $2
+                UNION ALL
+                SELECT created_at::date, 0, 0, 1, from_user_id
+                FROM skips WHERE created_at >= $1 AND created_at < $2
+            )
+            INSERT INTO daily_activity (day, new_users, likes, skips, active_users, finalized)
+            SELECT day, SUM(new_users), SUM(likes), SUM(skips), COUNT(DISTINCT user_id),
+                   day < CURRENT_DATE
+            FROM events
+            GROUP BY day
+            ON CONFLICT (day) DO UPDATE
+                SET new_users = EXCLUDED.new_users,
+                    likes = EXCLUDED.likes,
+                    skips = EXCLUDED.skips,
+                    active_users = EXCLUDED.active_users,
+                    finalized = EXCLUDED.finalized
+        """, start, end)
+        return int(status.split()[-1])
+
+    async def fold_activity(self):
+        """Сворачивает приращения из daily_activity_delta в daily_activity"""
+        async with self.connection() as conn:
+            # Один запрос: удаляются ровно те приращения, что сложены.
+            # Закрытые дни уже посчитаны точно, опоздавшие приращения к ним
+            # (транзакция началась до полуночи) просто выбрасываются
+            await conn.execute("""
+                WITH moved AS (
+                    DELETE FROM daily_activity_delta
+                    RETURNING day, new_users, likes, skips, active_users
+                )
+                INSERT INTO daily_activity (day, new_users, likes, skips, active_users)
+                SELECT day, SUM(new_users), SUM(likes), SUM(skips), SUM(active_users)
+                FROM moved
+                GROUP BY day
+                ON CONFLICT (day) DO UPDATE
+                    SET new_users = daily_activity.new_users + EXCLUDED.new_users,
+                        likes = daily_activity.likes + EXCLUDED.likes,
+                        skips = daily_activity.skips + EXCLUDED.skips,
+                        active_users = daily_activity.active_users + EXCLUDED.active_users
+                    WHERE NOT daily_activity.finalized
             """)
-            print("✅ Таблицы созданы/проверены")
 
-    # Остальные методы остаются без изменений...
+    async def finalize_activity(self):
+        """Закрывает прошедшие дни: точный пересчет и очистка daily_active_users"""
+        await self.fold_activity()
+        async with self.connection() as conn:
+            days = await conn.fetch("""
+                SELECT day FROM daily_activity
+                WHERE NOT finalized AND day < CURRENT_DATE
+                ORDER BY day
+            """)
+            for row in days:
+                async with conn.transaction():
+                    start = datetime.combine(row['day'], datetime.min.time())
+                    await self._recompute_activity(conn, start, start + timedelta(days=1))
+                    await conn.execute("UPDATE daily_activity SET finalized = TRUE WHERE day = $1", row['day'])
+            await conn.execute("DELETE FROM daily_active_users WHERE day < CURRENT_DATE")
+            return len(days)
+
+    async def rebuild_activity(self):
+        """Полностью пересчитывает daily_activity и активных за сегодня"""
+        async with self.connection() as conn:
+            async with conn.transaction():
+                await conn.execute("LOCK TABLE users, likes, skips IN SHARE MODE")
+                await conn.execute("DELETE FROM daily_activity")
+                await conn.execute("DELETE FROM daily_activity_delta")
+                await conn.execute("DELETE FROM daily_active_users")
+                count = await self._recompute_activity(conn, datetime.min, datetime.max)
+                await conn.execute("""
+                    INSERT INTO daily_active_users (day, user_id)
+                    SELECT CURRENT_DATE, from_user_id FROM likes WHERE created_at >= CURRENT_DATE
+                    UNION
+                    SELECT CURRENT_DATE, from_user_id FROM skips WHERE created_at >= CURRENT_DATE
+                """)
+            print(f"✅ Активность пересчитана за {count} дней")
+            return count
+
+    async def get_activity_timeline(self, days=7):
+        """Активность по дням за последние days дней (из daily_activity)"""
+        await self.finalize_activity()
+        async with self.connection() as conn:
+            rows = await conn.fetch("""
+                SELECT day AS date, new_users, likes, skips, active_users
+                FROM daily_activity
+                WHERE day >= CURRENT_DATE - $1::integer
+                ORDER BY day
+            """, days)
+            return [dict(row) for row in rows]
+
     async def get_user_by_tg(self, tg_id):
-        async with self.pool.acquire() as conn:
+        cached = self.user_cache.get(tg_id)
+        if cached is not None:
+            return dict(cached)
+
+        async with self.connection() as conn:
             row = await conn.fetchrow(
                 "SELECT id, telegram_id, name, interest_area, expertise_area, contact_tag FROM users WHERE telegram_id = $1",
                 tg_id
             )
-            return dict(row) if row else None
+            if not row:
+                return None
+            self.user_cache.set(tg_id, dict(row))
+            return dict(row)
 
     async def save_user(self, tg_id, name, interest, expertise, contact):
-        async with self.pool.acquire() as conn:
+        async with self.connection() as conn:
             row = await conn.fetchrow("""
                 INSERT INTO users (telegram_id, name, interest_area, expertise_area, contact_tag)
                 VALUES ($1, $2, $3, $4, $5)
@@ -80,156 +656,388 @@ class Database:
                     name = EXCLUDED.name,
                     interest_area = EXCLUDED.interest_area,
                     expertise_area = EXCLUDED.expertise_area,
-                    contact_tag = EXCLUDED.contact_tag
+                    contact_tag = EXCLUDED.contact_tag,
+                    updated_at = NOW()
                 RETURNING id, telegram_id, name, interest_area, expertise_area, contact_tag
             """, tg_id, name, interest, expertise, contact)
+            await self._save_tags(conn, [row])
+            self.ranker.update(row)
+            self.user_cache.set(tg_id, dict(row))
             return dict(row)
 
     async def update_user(self, tg_id, **kwargs):
         """Обновляет данные пользователя"""
-        async with self.pool.acquire() as conn:
-            set_parts = []
-            values = []
-            i = 1
-            
-            for field, value in kwargs.items():
-                if value is not None:
-                    set_parts.append(f"{field} = ${i}")
-                    values.append(value)
-                    i += 1
-            
-            if not set_parts:
-                return await self.get_user_by_tg(tg_id)
-            
-            values.append(tg_id)
-            query = f"""
-                UPDATE users 
-                SET {', '.join(set_parts)}
-                WHERE telegram_id = ${i}
-                RETURNING id, telegram_id, name, interest_area, expertise_area, contact_tag
-            """
-            
+        set_parts = []
+        values = []
+        i = 1
+        
+        for field, value in kwargs.items():
+            if value is not None:
+                set_parts.append(f"{field} = ${i}")
+                values.append(value)
+                i += 1
+        
+        if not set_parts:
+            return await self.get_user_by_tg(tg_id)
+        
+        values.append(tg_id)
+        query = f"""
+            UPDATE users 
+            SET {', '.join(set_parts)}, updated_at = NOW()
+            WHERE telegram_id = ${i}
+            RETURNING id, telegram_id, name, interest_area, expertise_area, contact_tag
+        """
+        
+        async with self.connection() as conn:
             row = await conn.fetchrow(query, *values)
-            return dict(row) if row else None
+            if not row:
+                self.user_cache.pop(tg_id)
+                return None
+            if kwargs.get('interest_area') is not None or kwargs.get('expertise_area') is not None:
+                await self._save_tags(conn, [row])
+                self.ranker.update(row)
+            self.user_cache.set(tg_id, dict(row))
+            return dict(row)
 
-    async def get_unseen_profiles(self, for_tg_id, limit=1):
-        async with self.pool.acquire() as conn:
-            my_user = await self.get_user_by_tg(for_tg_id)
-            if not my_user:
-                return []
+    async def get_unseen_profiles(self, user_id, limit=1, strategy=None):
+        """Непросмотренные анкеты для пользователя с внутренним id user_id.
+
+        strategy: "keyset" - случайные точки старта по индексу users.id,
+        "random" - полная сортировка ORDER BY RANDOM(), "ranked" - лучшие
+        по взаимодополняемости навыков (SkillRanker), "collaborative" -
+        по графу лайков (LikeRecommender). По умолчанию берется из
+        config.PROFILE_SAMPLING. Кандидатов берется с запасом, и пачку из
+        них собирает FairScheduler с учетом показов анкет.
+        """
+        strategy = strategy or config.PROFILE_SAMPLING
+        # Свайпы из буфера отложенной записи, которых в likes/skips еще нет
+        pending = self.swipes.pending_targets(user_id) if self.swipes else []
+
+        if strategy == "random":
+            async with self.connection() as conn:
+                profiles = await self._sample_random(conn, user_id, self.scheduler.pool_size(limit), pending)
+            return self.scheduler.select(profiles, limit)
+
+        if strategy == "ranked":
+            if self.ranker.ready:
+                return await self._sample_ranked(self.ranker, user_id, limit, pending)
+            # Индекс еще грузится - не держим пользователя, отдаем keyset
+            self.ranker.warm()
+
+        if strategy == "collaborative":
+            return await self._sample_ranked(self.recommender, user_id, limit, pending)
+
+        async with self.connection() as conn:
+            profiles = await self._sample_keyset_window(conn, limit)
+
+        # Индекс грузится вне блока соединения: загрузка идет отдельной
+        # задачей и берет соединение из пула сама
+        profiles = await self.seen_index.filter_unseen(user_id, profiles)
+        random.shuffle(profiles)
+        profiles = self.scheduler.select(profiles, limit)
+
+        if len(profiles) < limit:
+            # Вокруг случайных точек почти все уже просмотрено -
+            # отдаем фильтрацию базе
+            async with self.connection() as conn:
+                profiles = await self._sample_keyset(conn, user_id, self.scheduler.pool_size(limit), pending)
+            profiles = self.scheduler.select(profiles, limit)
+        return profiles
+
+    async def _sample_ranked(self, source, user_id, limit, pending):
+        seen = await self.seen_index.get(user_id)
+        exclude = set(pending)
+        pool = self.scheduler.pool_size(limit)
+        ranked = await source.ranked(user_id, seen, pool + len(exclude))
+        ids = [i for i in ranked if i not in exclude][:pool]
+
+        async with self.connection() as conn:
+            rows = await conn.fetch("""
+                SELECT id, telegram_id, name, interest_area, expertise_area
+                FROM users WHERE id = ANY($1::int[])
+            """, ids)
+            by_id = {row['id']: dict(row) for row in rows}
+            profiles = self.scheduler.select([by_id[i] for i in ids if i in by_id], limit)
+
+            if len(profiles) < limit:
+                # Подходящие кандидаты кончились - добираем случайными
+                taken = list(exclude) + [p['id'] for p in profiles]
+                profiles.extend(await self._sample_keyset(conn, user_id, limit - len(profiles), taken))
+        return profiles
+
+    async def _sample_random(self, conn, user_id, limit, exclude=()):
+        rows = await conn.fetch("""
+            SELECT u.id, u.telegram_id, u.name, u.interest_area, u.expertise_area
+            FROM users u
+            WHERE u.id != $1
+              AND u.id != ALL($3::int[])
+              AND u.id NOT IN (
+                SELECT to_user_id FROM likes WHERE from_user_id = $1
+              )
+              AND u.id NOT IN (
+                SELECT to_user_id FROM skips WHERE from_user_id = $1
+              )
+            ORDER BY RANDOM()
+            LIMIT $2
+        """, user_id, limit, list(exclude))
+
+        return [dict(row) for row in rows]
+
+    async def _sample_keyset_window(self, conn, limit, window=8):
+        # Те же случайные точки по id, но без likes и skips: просмотренные
+        # анкеты потом отсеиваются по индексу в памяти. Окно - диапазон
+        # id [точка, точка + window), а не window анкет после точки: так
+        # каждая анкета попадает в окно с одной вероятностью, и анкеты
+        # сразу после дыр в id не выпадают чаще остальных
+        rows = await conn.fetch("""
+            WITH bounds AS (
+                SELECT MIN(id) - $2 + 1 AS lo, MAX(id) AS hi FROM users
+            ),
+            pivots AS (
+                SELECT DISTINCT (b.lo + floor(random() * (b.hi - b.lo + 1)))::int AS pivot
+                FROM bounds b, generate_series(1, $1 * 2)
+            )
+            SELECT DISTINCT u.id, u.telegram_id, u.name, u.interest_area, u.expertise_area
+            FROM pivots p
+            JOIN users u ON u.id >= p.pivot AND u.id < p.pivot + $2
+        """, limit, window)
 
+        return [dict(row) for row in rows]
+
+    async def _sample_keyset(self, conn, user_id, limit, exclude=(), rounds=4, max_draws=20000):
+        """Равномерная выборка непросмотренных анкет случайными id.
+
+        Каждая точка - случайный id из диапазона, и берется только анкета
+        ровно с этим id, если она есть и не просмотрена. Так любая
+        непросмотренная анкета выпадает с одной вероятностью независимо от
+        дыр в id и от того, что пользователь уже видел, а точка стоит три
+        поиска по индексам, без прохода по просмотренным. Точек берется с
+        запасом по доле удачных в прошлом раунде; если после rounds раундов
+        анкет все еще мало, непросмотренных почти не осталось, и остаток
+        выбирается через ORDER BY random().
+        """
+        bounds = await conn.fetchrow("SELECT MIN(id) AS lo, MAX(id) AS hi FROM users")
+        if bounds['lo'] is None:
+            return []
+
+        profiles = []
+        taken = list(exclude)
+        draws = limit * 4
+        for _ in range(rounds):
             rows = await conn.fetch("""
+                WITH pivots AS (
+                    SELECT DISTINCT ($4::int + floor(random() * ($5::int - $4::int + 1)))::int AS pivot
+                    FROM generate_series(1, $2)
+                )
                 SELECT u.id, u.telegram_id, u.name, u.interest_area, u.expertise_area
-                FROM users u
+                FROM pivots p
+                JOIN users u ON u.id = p.pivot
                 WHERE u.id != $1
-                  AND u.id NOT IN (
-                    SELECT to_user_id FROM likes WHERE from_user_id = $1
+                  AND u.id != ALL($3::int[])
+                  AND NOT EXISTS (
+                    SELECT 1 FROM likes l WHERE l.from_user_id = $1 AND l.to_user_id = u.id
                   )
-                  AND u.id NOT IN (
-                    SELECT to_user_id FROM skips WHERE from_user_id = $1
+                  AND NOT EXISTS (
+                    SELECT 1 FROM skips s WHERE s.from_user_id = $1 AND s.to_user_id = u.id
                   )
-                ORDER BY RANDOM()
-                LIMIT $2
-            """, my_user['id'], limit)
-            
-            return [dict(row) for row in rows]
+            """, user_id, draws, taken, bounds['lo'], bounds['hi'])
+            found = [dict(row) for row in rows]
+            random.shuffle(found)
+            found = found[:limit - len(profiles)]
+            profiles.extend(found)
+            taken.extend(p['id'] for p in found)
+            if len(profiles) >= limit:
+                return profiles
+            # Доля удачных точек - оценка доли непросмотренных анкет
+            hit_rate = max(len(rows), 1) / draws
+            draws = min(int((limit - len(profiles)) / hit_rate * 2) + 1, max_draws)
 
-    async def save_like(self, from_tg_id, to_user_id):
-        async with self.pool.acquire() as conn:
-            from_user = await self.get_user_by_tg(from_tg_id)
-            if not from_user:
-                return False, "not_registered"
+        profiles.extend(await self._sample_random(conn, user_id, limit - len(profiles), taken))
+        return profiles
 
-            try:
-                await conn.execute(
-                    "INSERT INTO likes (from_user_id, to_user_id) VALUES ($1, $2)",
-                    from_user['id'], to_user_id
-                )
-                return True, from_user['id']
-            except asyncpg.UniqueViolationError:
+    async def save_like(self, from_user_id, to_user_id):
+        """Сохраняет лайк.
+
+        Возвращает (True, "match"), если лайк оказался взаимным,
+        (True, "liked") для обычного лайка и (False, "already_liked").
+        """
+        if self.swipes:
+            self.seen_index.add(from_user_id, to_user_id)
+            if self.swipes.has_like(from_user_id, to_user_id):
+                return False, "already_liked"
+            # Запись отложена, но о повторе и взаимности нужно сказать сразу:
+            # лайк мог уже уйти в базу с прошлой пачкой
+            async with self.connection() as conn:
+                row = await conn.fetchrow("""
+                    SELECT EXISTS (
+                               SELECT 1 FROM likes WHERE from_user_id = $1 AND to_user_id = $2
+                           ) AS liked,
+                           EXISTS (
+                               SELECT 1 FROM likes WHERE from_user_id = $2 AND to_user_id = $1
+                           ) AS is_match
+                """, from_user_id, to_user_id)
+            # Встречный лайк, который еще в буфере другого процесса, здесь
+            # не виден - такую пару найдет запись пачки (SwipeBuffer.on_match)
+            is_match = row['is_match'] or self.swipes.has_like(to_user_id, from_user_id)
+            # Пока шел запрос, тот же лайк мог прийти повторно - add_like это увидит
+            if row['liked'] or not self.swipes.add_like(from_user_id, to_user_id, matched=is_match):
                 return False, "already_liked"
+            self.recommender.add_like(from_user_id, to_user_id)
+            return True, "match" if is_match else "liked"
 
-    async def save_skip(self, from_tg_id, to_user_id):
-        async with self.pool.acquire() as conn:
-            from_user = await self.get_user_by_tg(from_tg_id)
-            if not from_user:
-                return False
+        async with self.connection() as conn:
+            # Взаимность решает триггер: он проверяет пару под блокировкой,
+            # и из двух одновременных встречных лайков второй дождется первого
+            # и создаст строку в matches (EXISTS по likes в том же запросе,
+            # что и вставка, встречный лайк из параллельной транзакции не
+            # видит). Проверка matches в той же транзакции: первый лайк пары
+            # держит блокировку до коммита, поэтому строку увидит только второй
+            async with conn.transaction():
+                is_new = await conn.fetchval("""
+                    INSERT INTO likes (from_user_id, to_user_id)
+                    VALUES ($1, $2)
+                    ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+                    RETURNING true
+                """, from_user_id, to_user_id)
+                is_match = is_new and await conn.fetchval("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM matches
+                        WHERE user1_id = LEAST($1::int, $2::int) AND user2_id = GREATEST($1::int, $2::int)
+                    )
+                """, from_user_id, to_user_id)
 
+            self.seen_index.add(from_user_id, to_user_id)
+            if not is_new:
+                return False, "already_liked"
+            self.recommender.add_like(from_user_id, to_user_id)
+            return True, "match" if is_match else "liked"
+
+    async def save_skip(self, from_user_id, to_user_id):
+        if self.swipes:
+            self.swipes.add_skip(from_user_id, to_user_id)
+            self.seen_index.add(from_user_id, to_user_id)
+            return True
+
+        async with self.connection() as conn:
             try:
                 await conn.execute("""
                     INSERT INTO skips (from_user_id, to_user_id) 
                     VALUES ($1, $2) 
                     ON CONFLICT DO NOTHING
-                """, from_user['id'], to_user_id)
-                return True
+                """, from_user_id, to_user_id)
             except Exception as e:
                 print(f"❌ Ошибка при сохранении пропуска: {e}")
                 return False
 
+            self.seen_index.add(from_user_id, to_user_id)
+            return True
+
+    async def get_seen_ids(self, user_id):
+        """id всех анкет, которые пользователь лайкнул или пропустил"""
+        # Буфер отложенной записи читается до базы: свайп, который уйдет в
+        # базу, пока идет запрос, попадет хотя бы в одно из двух чтений.
+        # В обратном порядке он мог бы проскочить мимо обоих
+        seen = self.swipes.pending_targets(user_id) if self.swipes else []
+        async with self.connection() as conn:
+            rows = await conn.fetch("""
+                SELECT to_user_id FROM likes WHERE from_user_id = $1
+                UNION
+                SELECT to_user_id FROM skips WHERE from_user_id = $1
+            """, user_id)
+        seen.extend(row['to_user_id'] for row in rows)
+        return seen
+
+    async def _flush_pending(self, user_id):
+        # Чтения по собственным свайпам пользователя должны их видеть:
+        # если что-то еще в буфере, сначала дописываем его в базу
+        if self.swipes and self.swipes.has_pending(user_id):
+            await self.swipes.flush()
+
     async def get_user_by_id(self, user_id):
-        async with self.pool.acquire() as conn:
+        async with self.connection() as conn:
             row = await conn.fetchrow(
                 "SELECT id, telegram_id, name, interest_area, expertise_area, contact_tag FROM users WHERE id = $1",
                 user_id
             )
             return dict(row) if row else None
 
-    async def get_likes_for_user(self, tg_id):
-        async with self.pool.acquire() as conn:
-            user = await self.get_user_by_tg(tg_id)
-            if not user:
-                return []
-
+    async def get_likes_for_user(self, user_id):
+        async with self.connection() as conn:
             rows = await conn.fetch("""
                 SELECT u.id, u.telegram_id, u.name, u.contact_tag, l.created_at
                 FROM likes l
                 JOIN users u ON l.from_user_id = u.id
                 WHERE l.to_user_id = $1
                 ORDER BY l.created_at DESC
-            """, user['id'])
+            """, user_id)
             
             return [dict(row) for row in rows]
 
-    async def get_mutual_likes(self, tg_id):
-        async with self.pool.acquire() as conn:
-            user = await self.get_user_by_tg(tg_id)
-            if not user:
-                return []
+    async def get_likes_page(self, user_id, cursor=None, newer=False, limit=30):
+        """Страница лайков пользователю, от новых к старым.
+
+        cursor - (created_at, id) лайка на границе текущей страницы: без
+        него отдается первая страница, с newer=False - лайки старше курсора,
+        с newer=True - новее. Строки возвращаются в порядке удаления от
+        курсора (limit + 1 строка, если дальше есть еще).
+        """
+        async with self.connection() as conn:
+            if cursor is None:
+                rows = await conn.fetch("""
+                    SELECT l.id AS like_id, l.created_at, u.id, u.telegram_id, u.name, u.contact_tag
+                    FROM likes l
+                    JOIN users u ON l.from_user_id = u.id
+                    WHERE l.to_user_id = $1
+                    ORDER BY l.created_at DESC, l.id DESC
+                    LIMIT $2
+                """, user_id, limit + 1)
+            elif newer:
+                rows = await conn.fetch("""
+                    SELECT l.id AS like_id, l.created_at, u.id, u.telegram_id, u.name, u.contact_tag
+                    FROM likes l
+                    JOIN users u ON l.from_user_id = u.id
+                    WHERE l.to_user_id = $1
+                      AND (l.created_at, l.id) > ($2, $3)
+                    ORDER BY l.created_at ASC, l.id ASC
+                    LIMIT $4
+                """, user_id, cursor[0], cursor[1], limit + 1)
+            else:
+                rows = await conn.fetch("""
+                    SELECT l.id AS like_id, l.created_at, u.id, u.telegram_id, u.name, u.contact_tag
+                    FROM likes l
+                    JOIN users u ON l.from_user_id = u.id
+                    WHERE l.to_user_id = $1
+                      AND (l.created_at, l.id) < ($2, $3)
+                    ORDER BY l.created_at DESC, l.id DESC
+                    LIMIT $4
+                """, user_id, cursor[0], cursor[1], limit + 1)
+
+            return [dict(row) for row in rows]
 
+    async def get_mutual_likes(self, user_id):
+        await self._flush_pending(user_id)
+        async with self.connection() as conn:
             rows = await conn.fetch("""
-                SELECT DISTINCT u.id, u.telegram_id, u.name, u.contact_tag
-                FROM likes l1
-                JOIN likes l2 ON l1.from_user_id = l2.to_user_id AND l1.to_user_id = l2.from_user_id
-                JOIN users u ON l2.from_user_id = u.id
-                WHERE l1.from_user_id = $1
-            """, user['id'])
+                SELECT u.id, u.telegram_id, u.name, u.contact_tag
+                FROM (
+                    SELECT user2_id AS other_id FROM matches WHERE user1_id = $1
+                    UNION ALL
+                    SELECT user1_id FROM matches WHERE user2_id = $1
+                ) m
+                JOIN users u ON u.id = m.other_id
+            """, user_id)
             
             return [dict(row) for row in rows]
 
-    async def get_user_stats(self, tg_id):
-        async with self.pool.acquire() as conn:
-            user = await self.get_user_by_tg(tg_id)
-            if not user:
-                return None
-
-            likes_received = await conn.fetchval(
-                "SELECT COUNT(*) FROM likes WHERE to_user_id = $1",
-                user['id']
-            )
-
-            likes_sent = await conn.fetchval(
-                "SELECT COUNT(*) FROM likes WHERE from_user_id = $1",
-                user['id']
-            )
+    async def get_user_stats(self, user_id):
+        await self._flush_pending(user_id)
+        async with self.connection() as conn:
+            row = await conn.fetchrow("""
+                SELECT likes_received, likes_sent, mutual_likes, skips
+                FROM user_counters
+                WHERE user_id = $1
+            """, user_id)
 
-            mutual_likes = await conn.fetchval("""
-                SELECT COUNT(*) FROM likes l1
-                JOIN likes l2 ON l1.from_user_id = l2.to_user_id AND l1.to_user_id = l2.from_user_id
-                WHERE l1.from_user_id = $1
-            """, user['id'])
-
-            return {
-                'likes_received': likes_received,
-                'likes_sent': likes_sent,
-                'mutual_likes': mutual_likes
-            }
\ No newline at end of file
+            if not row:
+                return {'likes_received': 0, 'likes_sent': 0, 'mutual_likes': 0, 'skips': 0}
+            return dict(row)
@@ -0,0 +1,136 @@
+import asyncio
+import random
+
+
+class ExposureTracker:
+    """Счетчики показов анкет.
+
+    Показы копятся в памяти и раз в flush_interval секунд дописываются в
+    profile_exposure одним запросом. В ответ база возвращает итоговые
+    счетчики, так что показы из других процессов тоже подтягиваются.
+    """
+
+    def __init__(self, db, flush_interval=30.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self._counts = {}   # id анкеты -> показов всего (база + буфер)
+        self._pending = {}  # id анкеты -> показов, еще не записанных в базу
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    async def start(self):
+        async with self.db.connection() as conn:
+            rows = await conn.fetch("SELECT profile_id, impressions FROM profile_exposure")
+        self._counts = {row['profile_id']: row['impressions'] for row in rows}
+        for profile_id, count in self._pending.items():
+            self._counts[profile_id] = self._counts.get(profile_id, 0) + count
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка при записи показов: {e}")
+
+    def record(self, profile_id):
+        """Анкета показана в ленте"""
+        self._counts[profile_id] = self._counts.get(profile_id, 0) + 1
+        self._pending[profile_id] = self._pending.get(profile_id, 0) + 1
+
+    def count(self, profile_id):
+        return self._counts.get(profile_id, 0)
+
+    async def flush(self):
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                async with self.db.connection() as conn:
+                    rows = await conn.fetch("""
+                        INSERT INTO profile_exposure (profile_id, impressions, last_shown_at)
+                        SELECT p.id, p.n, NOW()
+                        FROM unnest($1::int[], $2::int[]) AS p(id, n)
+                        WHERE EXISTS (SELECT 1 FROM users u WHERE u.id = p.id)
+                        ON CONFLICT (profile_id) DO UPDATE
+                        SET impressions = profile_exposure.impressions + EXCLUDED.impressions,
+                            last_shown_at = EXCLUDED.last_shown_at
+                        RETURNING profile_id, impressions
+                    """, list(pending), list(pending.values()))
+            except Exception:
+                # База недоступна - показы остаются в буфере до следующей попытки
+                for profile_id, count in pending.items():
+                    self._pending[profile_id] = self._pending.get(profile_id, 0) + count
+                raise
+            for row in rows:
+                # Итог из базы плюс то, что накопилось, пока шел запрос
+                self._counts[row['profile_id']] = row['impressions'] + self._pending.get(row['profile_id'], 0)
+            self.flushed += sum(pending.values())
+
+    def stats(self):
+        return {
+            'profiles': len(self._counts),
+            'pending': sum(self._pending.values()),
+            'flushed': self.flushed,
+        }
+
+
+class FairScheduler:
+    """Выбор анкет для ленты с поправкой на показы.
+
+    Из пула кандидатов основная часть пачки берется в порядке стратегии
+    выборки, а доля budget мест отдается наименее показанным анкетам
+    пула - так новые анкеты попадают в ленту, не дожидаясь случая. Анкеты,
+    показанные больше чем в cap раз чаще среднего по пулу, уходят в конец:
+    популярные профили не собирают все лайки, а с ними и уведомления.
+    """
+
+    def __init__(self, tracker, budget=0.3, cap=3.0, oversample=3):
+        self.tracker = tracker
+        self.budget = budget
+        self.cap = cap
+        self.oversample = oversample
+
+    def pool_size(self, limit):
+        """Сколько кандидатов запросить у стратегии на пачку из limit анкет"""
+        return limit * self.oversample if self.budget > 0 else limit
+
+    def select(self, candidates, limit):
+        """limit анкет из candidates (в порядке стратегии, лучшие первыми)"""
+        if self.budget <= 0 or len(candidates) <= limit:
+            return candidates[:limit]
+
+        counts = [self.tracker.count(p['id']) for p in candidates]
+        ceiling = self.cap * (sum(counts) / len(counts) + 1)
+        # Перепоказанные анкеты - в конец, остальной порядок сохраняем
+        ranked = [p for p, c in zip(candidates, counts) if c <= ceiling] + \
+                 [p for p, c in zip(candidates, counts) if c > ceiling]
+
+        fair = round(limit * self.budget)
+        primary = ranked[:limit - fair]
+        taken = {p['id'] for p in primary}
+        # Среди равных по показам - случайные, чтобы пачки не повторялись
+        rest = [p for p in ranked if p['id'] not in taken]
+        rest.sort(key=lambda p: (self.tracker.count(p['id']), random.random()))
+        boosted = rest[:fair]
+
+        # Поднятые анкеты вставляем равномерно, а не хвостом пачки
+        result = list(primary)
+        step = len(result) // len(boosted) + 1 if boosted else 0
+        for i, profile in enumerate(boosted):
+            result.insert(min(i * step + step // 2, len(result)), profile)
+        return result
@@ -0,0 +1,38 @@
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+
+
+class UserMiddleware(BaseMiddleware):
+    """Загружает профиль пользователя один раз на апдейт.
+
+    Профиль (или None для незарегистрированных) попадает в хендлеры
+    аргументом user.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __call__(self, handler, event, data):
+        tg_user = data.get('event_from_user')
+        data['user'] = await self.db.get_user_by_tg(tg_user.id) if tg_user else None
+        return await handler(event, data)
+
+
+class RegisteredOnlyMiddleware(BaseMiddleware):
+    """Не пускает незарегистрированных к хендлерам с флагом registered"""
+
+    async def __call__(self, handler, event, data):
+        if not get_flag(data, 'registered') or data.get('user') is not None:
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery):
+            # У инлайн-кнопок и слишком старых сообщений message нет -
+            # отвечаем всплывающим уведомлением
+            if event.message is None:
+                await event.answer("Сначала зарегистрируйся - /start", show_alert=True)
+                return
+            await event.message.answer("Сначала зарегистрируйся - /start")
+            await event.answer()
+        else:
+            await event.answer("Сначала зарегистрируйся - /start")
@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+
+class _Outbox:
+    __slots__ = ('likers', 'messages', 'attempts')
+
+    def __init__(self):
+        self.likers = []     # имена лайкнувших, склеиваются в одно сообщение
+        self.messages = []   # обычные сообщения, уходят по одному
+        self.attempts = 0
+
+
+class Notifier:
+    """Очередь исходящих уведомлений.
+
+    Хендлеры только кладут уведомление в очередь, а фоновые воркеры
+    отправляют их с общим лимитом (token bucket, ~30 сообщений в секунду)
+    и не чаще одного сообщения в секунду в один чат. Несколько ожидающих
+    уведомлений о лайках одному человеку склеиваются в одно сообщение.
+    """
+
+    def __init__(self, bot, rate=30, per_chat_interval=1.0, workers=4, max_attempts=5):
+        self.bot = bot
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._queue = asyncio.Queue()
+        self._outboxes = {}
+        self._next_allowed = {}
+        self._tokens = float(rate)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._bucket_lock = asyncio.Lock()
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """Пытается дослать очередь и останавливает воркеры"""
+        deadline = time.monotonic() + timeout
+        while self._outboxes and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._outboxes:
+            print(f"⚠️ Не успели отправить уведомления в {len(self._outboxes)} чатов")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _outbox(self, chat_id):
+        outbox = self._outboxes.get(chat_id)
+        if outbox is None:
+            outbox = _Outbox()
+            self._outboxes[chat_id] = outbox
+            self._queue.put_nowait(chat_id)
+            if len(self._next_allowed) > 10000:
+                now = time.monotonic()
+                self._next_allowed = {c: t for c, t in self._next_allowed.items() if t > now}
+        return outbox
+
+    def notify_like(self, chat_id, liker_name):
+        outbox = self._outboxes.get(chat_id)
+        if outbox is not None and outbox.likers:
+            self.coalesced += 1
+        self._outbox(chat_id).likers.append(liker_name)
+
+    def send(self, chat_id, text):
+        self._outbox(chat_id).messages.append(text)
+
+    @staticmethod
+    def _render_likes(likers):
+        if len(likers) == 1:
+            return (
+                f"🎉 Твой профиль понравился {likers[0]}!\n\n"
+                f"Теперь они могут написать тебе\n\n"
+                f"Посмотреть всех, кто тебя лайкнул - нажми '❤️ Мои лайки'"
+            )
+        names = ", ".join(likers[:5])
+        if len(likers) > 5:
+            names += f" и еще {len(likers) - 5}"
+        return (
+            f"🎉 Твой профиль понравился {len(likers)} людям: {names}!\n\n"
+            f"Теперь они могут написать тебе\n\n"
+            f"Посмотреть всех, кто тебя лайкнул - нажми '❤️ Мои лайки'"
+        )
+
+    async def _take_token(self):
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.rate, self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def _requeue(self, chat_id, delay):
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, chat_id)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._queue.get()
+            try:
+                await self._process(chat_id)
+            except Exception as e:
+                print(f"❌ Ошибка в очереди уведомлений: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, chat_id):
+        outbox = self._outboxes.get(chat_id)
+        if outbox is None:
+            return
+
+        wait = self._next_allowed.get(chat_id, 0) - time.monotonic()
+        if wait > 0:
+            self._requeue(chat_id, wait)
+            return
+
+        # Сначала обычные сообщения по порядку, затем склеенные лайки
+        likers_count = 0
+        if outbox.messages:
+            text = outbox.messages[0]
+        else:
+            likers_count = len(outbox.likers)
+            text = self._render_likes(outbox.likers)
+
+        await self._take_token()
+        try:
+            await self.bot.send_message(chat_id, text)
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать - притормаживаем всю очередь
+            self._paused_until = time.monotonic() + e.retry_after
+            self._requeue(chat_id, e.retry_after)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чат недоступен - повторять бессмысленно
+            print(f"⚠️ Уведомление для {chat_id} не доставлено: {e}")
+            self.dropped += 1
+            del self._outboxes[chat_id]
+            return
+        except Exception as e:
+            outbox.attempts += 1
+            if outbox.attempts >= self.max_attempts:
+                print(f"❌ Уведомление для {chat_id} не отправлено после {outbox.attempts} попыток: {e}")
+                self.dropped += 1
+                del self._outboxes[chat_id]
+                return
+            self._requeue(chat_id, 2 ** outbox.attempts)
+            return
+
+        self.sent += 1
+        outbox.attempts = 0
+        self._next_allowed[chat_id] = time.monotonic() + self.per_chat_interval
+        if likers_count:
+            # Лайки, пришедшие во время отправки, уйдут следующим сообщением
+            del outbox.likers[:likers_count]
+        else:
+            outbox.messages.pop(0)
+
+        if outbox.messages or outbox.likers:
+            self._requeue(chat_id, self.per_chat_interval)
+        else:
+            del self._outboxes[chat_id]
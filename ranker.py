@@ -0,0 +1,345 @@
+import asyncio
+import contextvars
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from tags import tokenize
+
+_EMPTY = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+
+def vectorize(text, dim, n=3):
+    """Хешированные символьные n-граммы тегов и сами теги, L2-нормированные.
+
+    Возвращает (признаки, веса), признаки отсортированы. N-граммы дают
+    сходство "python"/"python3"/"питон-разработка" не хуже, чем точное
+    совпадение тегов, а хеширование держит размерность фиксированной.
+    """
+    counts = {}
+    mask = dim - 1
+    for tag in tokenize(text):
+        padded = f"#{tag}#"
+        features = [padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))]
+        # Целый тег весит как две n-граммы
+        features += [f"w:{tag}"] * 2
+        for feature in features:
+            h = zlib.crc32(feature.encode()) & mask
+            counts[h] = counts.get(h, 0) + 1
+    if not counts:
+        return _EMPTY
+
+    feats = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    vals = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    order = np.argsort(feats)
+    feats, vals = feats[order], vals[order]
+    return feats, vals / np.linalg.norm(vals)
+
+
+def _dot(a, b):
+    common, ia, ib = np.intersect1d(a[0], b[0], assume_unique=True, return_indices=True)
+    if not len(common):
+        return 0.0
+    return float(np.dot(a[1][ia], b[1][ib]))
+
+
+class _PostingIndex:
+    """Векторы профилей по столбцам (признак -> слоты), как CSC-матрица"""
+
+    def __init__(self, dim, vectors):
+        lengths = np.fromiter((len(v[0]) for v in vectors), dtype=np.int64, count=len(vectors))
+        if lengths.sum():
+            feats = np.concatenate([v[0] for v in vectors])
+            vals = np.concatenate([v[1] for v in vectors])
+        else:
+            feats, vals = _EMPTY
+        slots = np.repeat(np.arange(len(vectors), dtype=np.int32), lengths)
+        order = np.argsort(feats, kind='stable')
+        self.slots = slots[order]
+        self.vals = vals[order]
+        self.indptr = np.searchsorted(feats[order], np.arange(dim + 1))
+        self.size = len(vectors)
+
+    def dot(self, query):
+        """Скалярные произведения запроса со всеми векторами индекса"""
+        feats, vals = query
+        if not len(feats):
+            return np.zeros(self.size, dtype=np.float32)
+        starts, ends = self.indptr[feats], self.indptr[feats + 1]
+        slots = np.concatenate([self.slots[s:e] for s, e in zip(starts, ends)])
+        weights = np.concatenate([self.vals[s:e] * v for s, e, v in zip(starts, ends, vals)])
+        return np.bincount(slots, weights=weights, minlength=self.size).astype(np.float32)
+
+
+class _TopK:
+    __slots__ = ('seq', 'scores', 'order')
+
+    def __init__(self, seq, scores):
+        self.seq = seq
+        self.scores = scores  # user_id -> оценка
+        self.order = sorted(scores, key=scores.get, reverse=True)
+
+
+class SkillRanker:
+    """Ранжирование ленты по взаимодополняемости навыков.
+
+    Хорошая пара - когда мои интересы совпадают с чужой экспертизой и
+    наоборот. Оценка кандидата v для пользователя u:
+
+        s1 = cos(interest_u, expertise_v)   - v может научить u
+        s2 = cos(expertise_u, interest_v)   - u может научить v
+        score = sqrt(s1 * s2) + 0.1 * (s1 + s2)
+
+    Первое слагаемое поднимает наверх обоюдный обмен, второе упорядочивает
+    односторонние совпадения. Векторы всех анкет держатся в памяти в виде
+    двух обратных индексов, кандидаты оцениваются пачкой за одно умножение.
+    Для пользователей держится кэш top_k лучших кандидатов; правки анкет
+    применяются к индексу и к кэшам сразу, без полного пересчета.
+    """
+
+    def __init__(self, db, dim=1 << 18, top_k=200, cache_size=10000, max_age=600, compact_after=2000):
+        self.db = db
+        self.dim = dim
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self.max_age = max_age
+        self.compact_after = compact_after
+        self._ids = []            # слот -> id пользователя
+        self._slots = {}          # id пользователя -> слот
+        self._vectors = []        # слот -> (интересы, экспертиза)
+        self._interest = None     # индексы по слотам < self._indexed
+        self._expertise = None
+        self._indexed = 0
+        self._stale = np.zeros(0, dtype=bool)  # слоты индекса, измененные после сборки
+        self._delta = set()       # слоты, которые надо оценивать мимо индекса
+        self._top = OrderedDict()
+        self._changes = []        # (seq, слот) правок анкет
+        self._seq = 0
+        self._floor = 0           # правки до этого seq уже выброшены из _changes
+        self._edited = {}         # правки во время перезагрузки
+        self._loaded_at = None
+        self._generation = 0      # растет при каждой полной загрузке
+        self._loading = None
+        self._compacting = None
+        self._compact_dirty = set()
+
+    # --- загрузка и сборка индекса ---
+
+    def _build(self, vectors):
+        interest = _PostingIndex(self.dim, [v[0] for v in vectors])
+        expertise = _PostingIndex(self.dim, [v[1] for v in vectors])
+        return interest, expertise
+
+    async def _load(self):
+        try:
+            self._edited = {}
+            async with self.db.connection() as conn:
+                rows = await conn.fetch("SELECT id, interest_area, expertise_area FROM users ORDER BY id")
+            ids = [row['id'] for row in rows]
+            texts = [(row['interest_area'], row['expertise_area']) for row in rows]
+
+            def prepare():
+                vectors = [(vectorize(i, self.dim), vectorize(e, self.dim)) for i, e in texts]
+                return vectors, self._build(vectors)
+
+            # Векторизация и сортировка - чистый CPU, уводим из цикла событий
+            vectors, (interest, expertise) = await asyncio.to_thread(prepare)
+
+            self._generation += 1
+            self._ids = ids
+            self._slots = {user_id: slot for slot, user_id in enumerate(ids)}
+            self._vectors = vectors
+            self._interest, self._expertise = interest, expertise
+            self._indexed = len(ids)
+            self._stale = np.zeros(len(ids), dtype=bool)
+            self._delta = set()
+            self._top.clear()
+            self._changes = []
+            self._floor = self._seq
+            self._loaded_at = time.monotonic()
+
+            # Анкеты, отредактированные пока шла загрузка
+            edited, self._edited = self._edited, {}
+            for user_id, texts in edited.items():
+                self._apply(user_id, *texts)
+            print(f"✅ Ранжирование: загружено {len(ids)} анкет")
+        finally:
+            self._loading = None
+
+    @property
+    def ready(self):
+        """Индекс загружен и ranked() отвечает без ожидания"""
+        return self._loaded_at is not None
+
+    def warm(self):
+        """Начинает загрузку индекса в фоне (при старте, до первого запроса)"""
+        if self._loading is None:
+            self._loading = asyncio.get_running_loop().create_task(
+                self._load(), context=contextvars.Context()
+            )
+        return self._loading
+
+    async def stop(self):
+        if self._loading is not None:
+            self._loading.cancel()
+            try:
+                await self._loading
+            except asyncio.CancelledError:
+                pass
+
+    async def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            self.warm()
+            if self._loaded_at is None:
+                # Первая загрузка - ждем; дальше устаревший индекс
+                # обновляется в фоне, а запросы обслуживает текущий
+                await asyncio.shield(self._loading)
+
+    async def _compact(self):
+        try:
+            self._compact_dirty = set()
+            vectors = list(self._vectors)
+            generation = self._generation
+            interest, expertise = await asyncio.to_thread(self._build, vectors)
+            if generation != self._generation:
+                # Пока собирали, индекс загрузился заново - сборка устарела
+                return
+            self._interest, self._expertise = interest, expertise
+            self._indexed = len(vectors)
+            self._stale = np.zeros(len(vectors), dtype=bool)
+            # Правки, сделанные во время сборки, остаются мимо индекса
+            self._delta = self._compact_dirty
+            for slot in self._delta:
+                if slot < self._indexed:
+                    self._stale[slot] = True
+        finally:
+            self._compacting = None
+            self._compact_dirty = set()
+
+    # --- правки анкет ---
+
+    def update(self, profile):
+        """Применяет новую или измененную анкету (после save_user/update_user)"""
+        if self._loading is not None:
+            self._edited[profile['id']] = (profile['interest_area'], profile['expertise_area'])
+        if self._loaded_at is None:
+            return
+        self._apply(profile['id'], profile['interest_area'], profile['expertise_area'])
+
+    def _apply(self, user_id, interest, expertise):
+        vectors = (vectorize(interest, self.dim), vectorize(expertise, self.dim))
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = len(self._ids)
+            self._ids.append(user_id)
+            self._slots[user_id] = slot
+            self._vectors.append(vectors)
+        else:
+            self._vectors[slot] = vectors
+            if slot < self._indexed:
+                self._stale[slot] = True
+        self._delta.add(slot)
+        if self._compacting is not None:
+            self._compact_dirty.add(slot)
+        self._seq += 1
+        self._changes.append((self._seq, slot))
+        # Свой список лучших пересчитывается целиком, чужие - точечно
+        self._top.pop(user_id, None)
+
+        if len(self._delta) > self.compact_after and self._compacting is None:
+            self._compacting = asyncio.get_running_loop().create_task(self._compact())
+
+    # --- оценка ---
+
+    def _score(self, s1, s2):
+        return np.sqrt(s1 * s2) + 0.1 * (s1 + s2)
+
+    def _score_all(self, slot):
+        interest, expertise = self._vectors[slot]
+        size = len(self._ids)
+        s1 = np.zeros(size, dtype=np.float32)
+        s2 = np.zeros(size, dtype=np.float32)
+        s1[:self._indexed] = self._expertise.dot(interest)
+        s2[:self._indexed] = self._interest.dot(expertise)
+        s1[:self._indexed][self._stale] = 0
+        s2[:self._indexed][self._stale] = 0
+        for other in self._delta:
+            s1[other] = _dot(interest, self._vectors[other][1])
+            s2[other] = _dot(expertise, self._vectors[other][0])
+        scores = self._score(s1, s2)
+        scores[slot] = 0
+        return scores
+
+    def _score_one(self, slot, other):
+        interest, expertise = self._vectors[slot]
+        s1 = _dot(interest, self._vectors[other][1])
+        s2 = _dot(expertise, self._vectors[other][0])
+        return float(self._score(np.float32(s1), np.float32(s2)))
+
+    def _build_top(self, user_id, slot, seen):
+        scores = self._score_all(slot)
+        k = min(self.top_k + len(seen), len(scores))
+        if not k:
+            return _TopK(self._seq, {})
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[scores[best] > 0]
+        ids = self._ids
+        top = {ids[i]: float(scores[i]) for i in best if ids[i] not in seen}
+        top = dict(sorted(top.items(), key=lambda item: item[1], reverse=True)[:self.top_k])
+        return _TopK(self._seq, top)
+
+    def _refresh(self, entry, slot):
+        """Досчитывает оценки анкет, измененных после построения списка"""
+        changed = {s for seq, s in self._changes if seq > entry.seq}
+        for other in changed:
+            if other == slot:
+                continue
+            user_id = self._ids[other]
+            score = self._score_one(slot, other)
+            if score > 0:
+                entry.scores[user_id] = score
+            else:
+                entry.scores.pop(user_id, None)
+        entry.order = sorted(entry.scores, key=entry.scores.get, reverse=True)
+        entry.seq = self._seq
+
+    async def ranked(self, user_id, seen, limit):
+        """id кандидатов по убыванию оценки, без просмотренных (seen)"""
+        await self._ensure_loaded()
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return []
+
+        entry = self._top.get(user_id)
+        if entry is not None:
+            self._top.move_to_end(user_id)
+            stale = sum(1 for seq, _ in self._changes if seq > entry.seq)
+            if entry.seq < self._floor or stale > self.top_k:
+                entry = None
+            elif stale:
+                self._refresh(entry, slot)
+
+        result = [i for i in entry.order if i not in seen] if entry else []
+        if len(result) < limit:
+            # Список выбран просмотрами - строим заново без просмотренных
+            entry = self._build_top(user_id, slot, seen)
+            self._top[user_id] = entry
+            self._top.move_to_end(user_id)
+            while len(self._top) > self.cache_size:
+                self._top.popitem(last=False)
+            result = list(entry.order)
+
+        if len(self._changes) > 10 * self.top_k:
+            # Старые правки нужны только спискам, которые все равно перестроятся
+            self._changes = self._changes[-self.top_k:]
+            self._floor = self._changes[0][0] - 1
+        return result
+
+    def stats(self):
+        return {
+            'profiles': len(self._ids),
+            'pending_edits': len(self._delta),
+            'cached_users': len(self._top),
+        }
@@ -0,0 +1,369 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# Строки двоичного COPY для (id, from_user_id, to_user_id): число полей,
+# затем длина и значение каждого int4
+_COPY_HEADER = 19  # сигнатура (11) + флаги (4) + длина расширения (4)
+_EDGE_ROW = np.dtype([
+    ('fields', '>i2'),
+    ('id_len', '>i4'), ('id', '>i4'),
+    ('from_len', '>i4'), ('from', '>i4'),
+    ('to_len', '>i4'), ('to', '>i4'),
+])
+
+# Сколько последних id лайков перечитывать при обновлении: транзакции
+# коммитятся не в порядке id, и лайк с меньшим id может появиться позже
+_REFRESH_OVERLAP = 10000
+
+
+def _csr(rows, cols, size):
+    """CSR по списку ребер: indptr (size + 1) и соседи в порядке ребер"""
+    order = np.argsort(rows, kind='stable')
+    indices = cols[order].astype(np.int32)
+    counts = np.bincount(rows, minlength=size)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, indices
+
+
+def _gather(indptr, indices, rows, cap=None):
+    """Соседи всех строк rows одним массивом и номер строки для каждого.
+
+    cap - сколько последних соседей брать из каждой строки.
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    if cap is not None:
+        starts = starts + np.maximum(lengths - cap, 0)
+        lengths = np.minimum(lengths, cap)
+    total = int(lengths.sum())
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    if not total:
+        return owner, indices[:0]
+    # Позиция каждого соседа: начало его строки + номер внутри строки
+    ends = np.cumsum(lengths)
+    offsets = np.repeat(starts - (ends - lengths), lengths) + np.arange(total)
+    return owner, indices[offsets]
+
+
+class _EdgeReader:
+    """Разбирает двоичный COPY лайков по мере прихода кусков.
+
+    В памяти остаются только NumPy-массивы (12 байт на лайк), а не
+    записи asyncpg на каждую строку.
+    """
+
+    def __init__(self):
+        self._tail = b''
+        self._header = True
+        self._parts = []
+
+    async def feed(self, chunk):
+        data = self._tail + chunk
+        if self._header:
+            if len(data) < _COPY_HEADER:
+                self._tail = data
+                return
+            start = _COPY_HEADER + int.from_bytes(data[15:19], 'big')
+            if len(data) < start:
+                self._tail = data
+                return
+            data = data[start:]
+            self._header = False
+        count = len(data) // _EDGE_ROW.itemsize
+        rows = np.frombuffer(data, dtype=_EDGE_ROW, count=count)
+        if count and (rows['fields'] != 3).any():
+            raise ValueError("Неожиданный формат COPY: ждали 3 колонки int4 без NULL")
+        self._parts.append((
+            rows['id'].astype(np.int32),
+            rows['from'].astype(np.int32),
+            rows['to'].astype(np.int32),
+        ))
+        # Остаток - начало следующей строки или завершающий маркер
+        self._tail = data[count * _EDGE_ROW.itemsize:]
+
+    def result(self):
+        """(id лайков, от кого, кому)"""
+        if not self._parts:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty, empty
+        return tuple(np.concatenate([part[i] for part in self._parts]) for i in range(3))
+
+
+class LikeGraph:
+    """Граф лайков как разреженная матрица пользователь x пользователь.
+
+    Хранится дважды: по строкам (кого лайкнул) и по столбцам (кто лайкнул),
+    id пользователей используются как номера строк напрямую. Ребра
+    передаются от старых к новым, и внутри строки этот порядок сохраняется.
+    """
+
+    def __init__(self, from_ids, to_ids, max_likers=50, max_neighbors=50):
+        self.from_ids = np.asarray(from_ids, dtype=np.int32)
+        self.to_ids = np.asarray(to_ids, dtype=np.int32)
+        self.size = int(max(self.from_ids.max(initial=0), self.to_ids.max(initial=0))) + 1
+        self.out_indptr, self.out_indices = _csr(self.from_ids, self.to_ids, self.size)
+        self.in_indptr, self.in_indices = _csr(self.to_ids, self.from_ids, self.size)
+        self.out_degree = np.diff(self.out_indptr).astype(np.float32)
+        self.in_degree = np.diff(self.in_indptr).astype(np.float32)
+        # Ограничения перебора: у популярной анкеты берем только последних
+        # лайкнувших, у пользователя - только самых похожих соседей
+        self.max_likers = max_likers
+        self.max_neighbors = max_neighbors
+
+    def merged(self, from_ids, to_ids):
+        """Новый граф с добавленными ребрами"""
+        return LikeGraph(
+            np.concatenate([self.from_ids, from_ids]),
+            np.concatenate([self.to_ids, to_ids]),
+            self.max_likers, self.max_neighbors
+        )
+
+    def has_edge(self, from_id, to_id):
+        if from_id >= self.size:
+            return False
+        row = self.out_indices[self.out_indptr[from_id]:self.out_indptr[from_id + 1]]
+        return bool((row == to_id).any())
+
+    def recommend(self, users, top_k, extra=None):
+        """Лучшие кандидаты для пачки пользователей за несколько векторных проходов.
+
+        "Люди, лайкнувшие тех же, кого лайкнул ты, лайкали еще и ...":
+        для u считаем пересечения его лайков с лайками остальных (c = A a_u),
+        затем суммируем их лайки с этими весами (A^T c). Вклад активных
+        лайкеров и популярных анкет приглушается делением на корень степени.
+        extra - лайки из users, которых еще нет в графе: {номер в users: [id]}.
+        Возвращает {id пользователя: (id кандидатов, оценки)}.
+        """
+        users = np.asarray(users, dtype=np.int64)
+        inside = users < self.size
+        owner, items = _gather(self.out_indptr, self.out_indices, np.where(inside, users, 0))
+        keep = inside[owner]
+        owner, items = owner[keep], items[keep]
+        if extra:
+            extra_owner = np.concatenate([np.full(len(v), k) for k, v in extra.items()])
+            extra_items = np.concatenate([np.asarray(v, dtype=np.int32) for v in extra.values()])
+            known = extra_items < self.size
+            owner = np.concatenate([owner, extra_owner[known]])
+            items = np.concatenate([items, extra_items[known]])
+
+        # Соседи: кто еще лайкнул те же анкеты и сколько у нас общих лайков
+        o2, likers = _gather(self.in_indptr, self.in_indices, items, self.max_likers)
+        o2 = owner[o2]
+        mask = likers != users[o2]
+        keys, overlap = np.unique(o2[mask] * self.size + likers[mask], return_counts=True)
+        n_owner, neighbors = keys // self.size, keys % self.size
+        weight = overlap / np.sqrt(self.out_degree[neighbors])
+
+        # Сортировка по (пользователь, -вес) одним ключом: дробная часть
+        # 1 / (1 + вес) убывает с весом и не выходит за пределы (0, 1)
+        order = np.argsort(n_owner + 1 / (1 + weight))
+        n_owner, neighbors, weight = n_owner[order], neighbors[order], weight[order]
+        rank = np.arange(len(n_owner)) - np.searchsorted(n_owner, n_owner)
+        best = rank < self.max_neighbors
+        n_owner, neighbors, weight = n_owner[best], neighbors[best], weight[best]
+
+        # Кандидаты: кого лайкали соседи, с весом соседа
+        o3, candidates = _gather(self.out_indptr, self.out_indices, neighbors)
+        keys, inverse = np.unique(n_owner[o3] * self.size + candidates, return_inverse=True)
+        scores = np.bincount(inverse, weights=weight[o3]).astype(np.float64)
+        c_owner, candidates = keys // self.size, keys % self.size
+        scores /= np.sqrt(self.in_degree[candidates])
+
+        # Себя и уже лайкнутых не предлагаем: keys отсортированы, лайки
+        # пользователя находим двоичным поиском
+        if len(keys):
+            liked = owner * self.size + items
+            pos = np.minimum(np.searchsorted(keys, liked), len(keys) - 1)
+            scores[pos[keys[pos] == liked]] = 0
+            scores[candidates == users[c_owner]] = 0
+        keep = scores > 0
+        c_owner, candidates, scores = c_owner[keep], candidates[keep], scores[keep]
+
+        # top_k на каждого пользователя
+        order = np.argsort(c_owner + 1 / (1 + scores))
+        c_owner, candidates, scores = c_owner[order], candidates[order], scores[order]
+        rank = np.arange(len(c_owner)) - np.searchsorted(c_owner, c_owner)
+        best = rank < top_k
+        c_owner, candidates, scores = c_owner[best], candidates[best], scores[best].astype(np.float32)
+
+        bounds = np.searchsorted(c_owner, np.arange(len(users) + 1))
+        return {
+            int(users[i]): (candidates[bounds[i]:bounds[i + 1]], scores[bounds[i]:bounds[i + 1]])
+            for i in range(len(users))
+        }
+
+
+class _Recommendations:
+    __slots__ = ('ids', 'created_at')
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.created_at = time.monotonic()
+
+
+class LikeRecommender:
+    """Рекомендации по графу лайков (коллаборативная фильтрация).
+
+    Граф читается из likes двоичным COPY прямо в NumPy-массивы и дальше
+    обновляется только новыми лайками (id больше уже прочитанных): раз в
+    max_age секунд и когда своих лайков накопилось больше refresh_after.
+    Свои свежие лайки пользователь видит в рекомендациях сразу: они
+    добавляются к его строке при расчете. Списки top_k кандидатов
+    кэшируются; после обновления графа кэш пересчитывается пачками по
+    block пользователей в отдельном потоке. Вся работа с массивами при
+    обновлении идет вне цикла событий, и пересчитываются только
+    пользователи из кэша, а не все. Пока граф не загружен (стратегия
+    collaborative не используется), свои лайки не копятся вовсе.
+    """
+
+    def __init__(self, db, top_k=100, cache_size=10000, max_age=600, refresh_after=5000, block=32):
+        self.db = db
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self.max_age = max_age
+        self.refresh_after = refresh_after
+        self.block = block
+        self.graph = None
+        self._last_id = 0
+        self._recent_ids = np.zeros(0, dtype=np.int32)  # id лайков окна перекрытия
+        self._pending = deque()   # (from, to) лайков, которых нет в графе, от старых
+        self._pending_by_user = {}
+        self._top = OrderedDict()
+        self._loaded_at = None
+        self._refreshing = None
+
+    async def _fetch(self, after_id):
+        reader = _EdgeReader()
+        async with self.db.connection() as conn:
+            await conn.copy_from_query("""
+                SELECT id, from_user_id, to_user_id FROM likes
+                WHERE id > $1 AND from_user_id IS NOT NULL AND to_user_id IS NOT NULL
+                ORDER BY id
+            """, after_id, output=reader.feed, format='binary')
+        return reader.result()
+
+    def _rescore(self, graph, user_ids, extras):
+        """Списки кандидатов для user_ids пачками (в отдельном потоке)"""
+        result = {}
+        for i in range(0, len(user_ids), self.block):
+            block = user_ids[i:i + self.block]
+            extra = {k: extras[u] for k, u in enumerate(block) if u in extras}
+            for user_id, (ids, _) in graph.recommend(block, self.top_k, extra).items():
+                result[user_id] = [int(x) for x in ids]
+        return result
+
+    @staticmethod
+    def _merge(graph, recent_ids, ids, from_ids, to_ids, pending):
+        """Новые ребра в граф и свои лайки, которые в нем уже есть (в отдельном потоке)"""
+        if graph is None:
+            graph = LikeGraph(from_ids, to_ids)
+        else:
+            # Лайки из окна перекрытия, которые уже в графе
+            fresh = ~np.isin(ids, recent_ids)
+            ids, from_ids, to_ids = ids[fresh], from_ids[fresh], to_ids[fresh]
+            if len(ids):
+                graph = graph.merged(from_ids, to_ids)
+        merged = {pair for pair in pending if graph.has_edge(*pair)}
+        return graph, ids, merged
+
+    async def _refresh(self):
+        try:
+            graph = self.graph
+            after = max(self._last_id - _REFRESH_OVERLAP, 0) if graph is not None else 0
+            ids, from_ids, to_ids = await self._fetch(after)
+            # Сборка графа и сверка со своими лайками - чистый CPU, уводим
+            # из цикла событий; в цикле остаются только обходы списков
+            graph, ids, merged = await asyncio.to_thread(
+                self._merge, graph, self._recent_ids, ids, from_ids, to_ids, list(self._pending)
+            )
+            self.graph = graph
+            if len(ids):
+                recent = np.concatenate([self._recent_ids, ids])
+                self._last_id = max(self._last_id, int(ids.max()))
+                self._recent_ids = recent[recent > self._last_id - _REFRESH_OVERLAP]
+
+            # Свои лайки, которые уже попали в граф, больше не нужны отдельно
+            if merged:
+                self._pending = deque(pair for pair in self._pending if pair not in merged)
+                self._pending_by_user = {}
+                for from_id, to_id in self._pending:
+                    self._pending_by_user.setdefault(from_id, []).append(to_id)
+            self._loaded_at = time.monotonic()
+
+            if len(ids) and self._top:
+                users = list(self._top)
+                extras = {u: list(self._pending_by_user[u]) for u in users if u in self._pending_by_user}
+                lists = await asyncio.to_thread(self._rescore, graph, users, extras)
+                for user_id, result in lists.items():
+                    # Записи, сброшенные новым лайком за время пересчета, не трогаем
+                    if user_id in self._top:
+                        self._top[user_id] = _Recommendations(result)
+            print(f"✅ Рекомендации: добавлено {len(ids)} лайков, всего {len(graph.from_ids)}")
+        finally:
+            self._refreshing = None
+
+    def _start_refresh(self):
+        if self._refreshing is None:
+            self._refreshing = asyncio.get_running_loop().create_task(
+                self._refresh(), context=contextvars.Context()
+            )
+        return self._refreshing
+
+    async def _ensure_loaded(self):
+        if self._loaded_at is None:
+            await asyncio.shield(self._start_refresh())
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            # Устаревший граф дочитывается в фоне, запросы обслуживает текущий
+            self._start_refresh()
+
+    def add_like(self, from_user_id, to_user_id):
+        """Новый лайк (вызывается из save_like при любой стратегии выборки)"""
+        if self.graph is None and self._refreshing is None:
+            # Рекомендации не используются - лайк прочитается из базы при загрузке
+            return
+        self._pending.append((from_user_id, to_user_id))
+        self._pending_by_user.setdefault(from_user_id, []).append(to_user_id)
+        self._top.pop(from_user_id, None)
+        if len(self._pending) > 2 * self.refresh_after:
+            # Обновление не успевает (или база недоступна) - старые лайки
+            # все равно в базе и придут со следующим обновлением
+            old_from, old_to = self._pending.popleft()
+            likes = self._pending_by_user[old_from]
+            likes.remove(old_to)
+            if not likes:
+                del self._pending_by_user[old_from]
+        if self.graph is not None and len(self._pending) > self.refresh_after:
+            self._start_refresh()
+
+    async def ranked(self, user_id, seen, limit):
+        """id кандидатов по убыванию оценки, без просмотренных (seen)"""
+        await self._ensure_loaded()
+        entry = self._top.get(user_id)
+        if entry is not None and time.monotonic() - entry.created_at > self.max_age:
+            entry = None
+        if entry is not None:
+            self._top.move_to_end(user_id)
+            result = [i for i in entry.ids if i not in seen]
+            if len(result) >= limit:
+                return result
+
+        extra = self._pending_by_user.get(user_id)
+        ids, _ = self.graph.recommend([user_id], self.top_k + len(seen), {0: extra} if extra else None)[user_id]
+        entry = _Recommendations([int(i) for i in ids if int(i) not in seen][:self.top_k])
+        self._top[user_id] = entry
+        self._top.move_to_end(user_id)
+        while len(self._top) > self.cache_size:
+            self._top.popitem(last=False)
+        return list(entry.ids)
+
+    def stats(self):
+        return {
+            'likes': len(self.graph.from_ids) if self.graph is not None else 0,
+            'pending_likes': len(self._pending),
+            'cached_users': len(self._top),
+        }
@@ -13,6 +13,17 @@ async def reset_database():
         print("🗑️ Начинаем полный сброс базы данных...")
         
         # Удаляем все таблицы (в правильном порядке из-за внешних ключей)
+        await conn.execute("DROP TABLE IF EXISTS schema_version CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS fsm_storage CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS profile_exposure CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS export_watermarks CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS user_tags CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS tags CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS daily_active_users CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS daily_activity_delta CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS daily_activity CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS user_counters CASCADE")
+        await conn.execute("DROP TABLE IF EXISTS matches CASCADE")
         await conn.execute("DROP TABLE IF EXISTS likes CASCADE")
         await conn.execute("DROP TABLE IF EXISTS skips CASCADE") 
         await conn.execute("DROP TABLE IF EXISTS users CASCADE")
@@ -28,7 +39,8 @@ async def reset_database():
                 interest_area TEXT,
                 expertise_area TEXT,
                 contact_tag VARCHAR(100),
-                created_at TIMESTAMP DEFAULT NOW()
+                created_at TIMESTAMP DEFAULT NOW(),
+                updated_at TIMESTAMP DEFAULT NOW()
             )
         """)
         
@@ -1,6 +1,5 @@
 import asyncio
 import schedule
-import time
 from datetime import datetime
 from uploader import DataUploader, db
 
@@ -21,21 +20,22 @@ async def daily_export_job():
     except Exception as e:
         print(f"❌ Критическая ошибка при выгрузке: {e}")
 
-def run_scheduler():
-    """Запуск планировщика"""
-    
-    print("⏰ Планировщик выгрузки данных запущен")
-    print("=" * 50)
-    
+async def scheduler_loop():
+    """Один цикл событий на все выгрузки.
+
+    Пул соединений и фоновые задачи базы (показы, ранжирование) привязаны
+    к циклу, в котором созданы: asyncio.run на каждую выгрузку оставлял бы
+    их на закрытом цикле. Задачи расписания запускаются в этом же цикле.
+    """
     # Настрой расписание
     # Ежедневно в 3:00 ночи
     schedule.every().day.at("03:00").do(
-        lambda: asyncio.run(daily_export_job())
+        lambda: asyncio.get_running_loop().create_task(daily_export_job())
     )
     
     # Каждый день в 12:00 (для теста)
     schedule.every().day.at("12:00").do(
-        lambda: asyncio.run(daily_export_job())
+        lambda: asyncio.get_running_loop().create_task(daily_export_job())
     )
     
     # Каждый час выводим статус
@@ -43,20 +43,31 @@ def run_scheduler():
         lambda: print(f"⏱️  Статус: следующая выгрузка через {int(schedule.idle_seconds()/60)} мин.")
     )
     
-    # Первая выгрузка сразу при запуске (для теста)
-    print("🚀 Запускаю первую выгрузку сейчас...")
-    asyncio.run(daily_export_job())
+    try:
+        # Первая выгрузка сразу при запуске (для теста)
+        print("🚀 Запускаю первую выгрузку сейчас...")
+        await daily_export_job()
+        
+        print("\n📅 Расписание выгрузки:")
+        print("   - Ежедневно в 03:00")
+        print("   - Ежедневно в 12:00")
+        print("   - Следующая выгрузка через ~1 час")
+        print("=" * 50)
+        
+        # Бесконечный цикл планировщика
+        while True:
+            schedule.run_pending()
+            await asyncio.sleep(60)  # Проверяем каждую минуту
+    finally:
+        await db.close()
+
+def run_scheduler():
+    """Запуск планировщика"""
     
-    print("\n📅 Расписание выгрузки:")
-    print("   - Ежедневно в 03:00")
-    print("   - Ежедневно в 12:00")
-    print("   - Следующая выгрузка через ~1 час")
+    print("⏰ Планировщик выгрузки данных запущен")
     print("=" * 50)
     
-    # Бесконечный цикл планировщика
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Проверяем каждую минуту
+    asyncio.run(scheduler_loop())
 
 if __name__ == "__main__":
-    run_scheduler()
\ No newline at end of file
+    run_scheduler()
@@ -0,0 +1,188 @@
+import asyncio
+import bisect
+import contextvars
+import sys
+import time
+from array import array
+from collections import OrderedDict
+
+# Контейнер на 65536 id: пока значений мало - отсортированный массив,
+# после порога - плотная битовая карта на 8 КБ (как в roaring bitmap)
+_ARRAY_LIMIT = 4096
+_BITMAP_BYTES = 65536 // 8
+
+
+class SeenBitmap:
+    """Сжатое множество id пользователей"""
+
+    __slots__ = ('_containers', '_size')
+
+    def __init__(self, ids=()):
+        self._containers = {}
+        self._size = 0
+        for user_id in sorted(ids):
+            self.add(user_id)
+
+    def add(self, user_id):
+        high, low = user_id >> 16, user_id & 0xFFFF
+        container = self._containers.get(high)
+
+        if container is None:
+            self._containers[high] = array('H', [low])
+            self._size += 1
+            return
+
+        if isinstance(container, bytearray):
+            byte, bit = low >> 3, 1 << (low & 7)
+            if not container[byte] & bit:
+                container[byte] |= bit
+                self._size += 1
+            return
+
+        pos = bisect.bisect_left(container, low)
+        if pos < len(container) and container[pos] == low:
+            return
+        container.insert(pos, low)
+        self._size += 1
+
+        if len(container) > _ARRAY_LIMIT:
+            dense = bytearray(_BITMAP_BYTES)
+            for value in container:
+                dense[value >> 3] |= 1 << (value & 7)
+            self._containers[high] = dense
+
+    def __contains__(self, user_id):
+        container = self._containers.get(user_id >> 16)
+        if container is None:
+            return False
+        low = user_id & 0xFFFF
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        pos = bisect.bisect_left(container, low)
+        return pos < len(container) and container[pos] == low
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self._containers) + sum(
+            sys.getsizeof(c) for c in self._containers.values()
+        )
+
+
+class _Entry:
+    __slots__ = ('bitmap', 'nbytes', 'last_access')
+
+    def __init__(self, bitmap):
+        self.bitmap = bitmap
+        self.nbytes = bitmap.nbytes
+        self.last_access = time.monotonic()
+
+
+class _Loading:
+    __slots__ = ('task', 'pending')
+
+    def __init__(self):
+        self.task = None
+        self.pending = set()
+
+
+class SeenIndex:
+    """Индекс просмотренных анкет (лайки + пропуски) в памяти процесса.
+
+    Множество пользователя загружается из likes/skips при первом обращении
+    и дальше обновляется из save_like/save_skip. Давно неактивные
+    пользователи выгружаются, чтобы индекс укладывался в бюджет памяти.
+    """
+
+    def __init__(self, db, max_bytes=64 * 1024 * 1024, idle_seconds=3600):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+
+    def _put(self, user_id, bitmap):
+        old = self._entries.pop(user_id, None)
+        if old:
+            self.total_bytes -= old.nbytes
+        entry = _Entry(bitmap)
+        self._entries[user_id] = entry
+        self.total_bytes += entry.nbytes
+        self._evict()
+        return entry
+
+    def _evict(self):
+        deadline = time.monotonic() - self.idle_seconds
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if self.total_bytes <= self.max_bytes and entry.last_access >= deadline:
+                break
+            del self._entries[user_id]
+            self.total_bytes -= entry.nbytes
+            self.evictions += 1
+
+    async def _load(self, user_id, loading):
+        try:
+            ids = await self.db.get_seen_ids(user_id)
+            bitmap = SeenBitmap(ids)
+            # Просмотры, записанные пока шла загрузка
+            for profile_id in loading.pending:
+                bitmap.add(profile_id)
+            return self._put(user_id, bitmap).bitmap
+        finally:
+            del self._loading[user_id]
+
+    async def get(self, user_id):
+        """Множество просмотренных анкет пользователя (загружается лениво)"""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry.last_access = time.monotonic()
+            self._entries.move_to_end(user_id)
+            return entry.bitmap
+
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = _Loading()
+            self._loading[user_id] = loading
+            # Загрузка идет в чистом контексте: она общая для всех ждущих и не
+            # должна использовать соединение, взятое вызвавшей задачей
+            loading.task = asyncio.get_running_loop().create_task(
+                self._load(user_id, loading), context=contextvars.Context()
+            )
+        return await asyncio.shield(loading.task)
+
+    def add(self, user_id, profile_id):
+        """Отмечает анкету просмотренной (вызывается после записи лайка/пропуска)"""
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            loading.pending.add(profile_id)
+
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        entry.bitmap.add(profile_id)
+        nbytes = entry.bitmap.nbytes
+        self.total_bytes += nbytes - entry.nbytes
+        entry.nbytes = nbytes
+        self._evict()
+
+    async def filter_unseen(self, user_id, profiles):
+        seen = await self.get(user_id)
+        return [p for p in profiles if p['id'] != user_id and p['id'] not in seen]
+
+    def memory_report(self):
+        """Сколько памяти занимает индекс"""
+        users = len(self._entries)
+        seen_total = sum(len(e.bitmap) for e in self._entries.values())
+        per_user = self.total_bytes / users if users else 0
+        return {
+            'users_loaded': users,
+            'seen_entries': seen_total,
+            'total_bytes': self.total_bytes,
+            'bytes_per_10k_users': int(per_user * 10000),
+            'evictions': self.evictions,
+        }
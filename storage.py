@@ -0,0 +1,375 @@
+import asyncio
+import json
+import pickle
+import sys
+import time
+import uuid
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+CHANNEL = "fsm_storage"
+# Ключей в одном NOTIFY: полезная нагрузка ограничена 8000 байт
+NOTIFY_CHUNK = 50
+
+
+class _Record:
+    __slots__ = ('state', 'data')
+
+    def __init__(self, state=None, data=None):
+        self.state = state
+        self.data = data or {}
+
+
+def _key(key):
+    return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny)
+
+
+class PostgresStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_storage.
+
+    Состояния и данные читаются из кэша в памяти процесса, а изменения
+    копятся и раз в flush_interval записываются в базу одним запросом
+    (несколько set_state/update_data за апдейт превращаются в одну запись).
+    После записи процесс рассылает NOTIFY, и другие процессы бота
+    сбрасывают у себя эти ключи - так несколько процессов могут работать
+    с одними пользователями, а незаконченная регистрация переживает рестарт.
+    """
+
+    def __init__(self, db, flush_interval=0.1, cache_size=10000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._cache = OrderedDict()   # ключ -> _Record
+        self._dirty = {}              # ключ -> _Record, еще не записанные в базу
+        self._origin = uuid.uuid4().hex
+        self._flush_lock = asyncio.Lock()
+        self._listener = None
+        self._reconnecting = None
+        self._closing = False
+        self._task = None
+
+    async def start(self):
+        """Запускает фоновую запись и подписку на изменения (после create_pool)"""
+        if self._task:
+            return
+        self._closing = False
+        await self._listen()
+        self._task = asyncio.create_task(self._run())
+
+    async def _listen(self):
+        # Отдельное соединение, а не из пула: LISTEN держит его все время
+        conn = await self.db.connect()
+        try:
+            await conn.add_listener(CHANNEL, self._on_notify)
+        except Exception:
+            await conn.close()
+            raise
+        conn.add_termination_listener(self._on_terminated)
+        self._listener = conn
+
+    def _on_terminated(self, conn):
+        if conn is not self._listener or self._closing:
+            return
+        print("⚠️ Соединение подписки FSM потеряно, переподключаемся")
+        self._listener = None
+        # Пока подписки нет, изменения из других процессов не доходят
+        self._drop_cached()
+        if self._reconnecting is None:
+            self._reconnecting = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1.0
+        try:
+            while not self._closing:
+                try:
+                    await self._listen()
+                except Exception as e:
+                    print(f"❌ Не удалось восстановить подписку FSM: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30.0)
+                    continue
+                # Что успели прочитать без подписки, могло устареть
+                self._drop_cached()
+                print("✅ Подписка FSM восстановлена")
+                return
+        finally:
+            self._reconnecting = None
+
+    def _drop_cached(self):
+        for key in [key for key in self._cache if key not in self._dirty]:
+            del self._cache[key]
+
+    async def close(self):
+        self._closing = True
+        if self._reconnecting:
+            self._reconnecting.cancel()
+            try:
+                await self._reconnecting
+            except asyncio.CancelledError:
+                pass
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._listener:
+            listener, self._listener = self._listener, None
+            await listener.close()
+
+    def _on_notify(self, conn, pid, channel, payload):
+        message = json.loads(payload)
+        if message['origin'] == self._origin:
+            return
+        for key in message['keys']:
+            key = tuple(key)
+            # Свои незаписанные изменения не трогаем - они все равно перезапишут строку
+            if key not in self._dirty:
+                self._cache.pop(key, None)
+
+    async def _get(self, key):
+        record = self._cache.get(key)
+        if record is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return record
+
+        self.misses += 1
+        async with self.db.connection() as conn:
+            row = await conn.fetchrow("""
+                SELECT state, data::text AS data FROM fsm_storage
+                WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3
+                  AND thread_id = $4 AND destiny = $5
+            """, *key)
+
+        # Пока шел запрос, ключ мог быть записан - он новее прочитанного
+        record = self._cache.get(key)
+        if record is not None:
+            return record
+        record = _Record(row['state'], json.loads(row['data'])) if row else _Record()
+        self._cache[key] = record
+        self._evict()
+        return record
+
+    def _evict(self):
+        while len(self._cache) > self.cache_size:
+            for key in self._cache:
+                if key not in self._dirty:
+                    del self._cache[key]
+                    break
+            else:
+                return
+
+    def _changed(self, key, record):
+        self._dirty[key] = record
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+
+    async def set_state(self, key, state=None):
+        key = _key(key)
+        record = await self._get(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._changed(key, record)
+
+    async def get_state(self, key):
+        return (await self._get(_key(key))).state
+
+    async def set_data(self, key, data):
+        key = _key(key)
+        record = await self._get(key)
+        record.data = dict(data)
+        self._changed(key, record)
+
+    async def get_data(self, key):
+        return dict((await self._get(_key(key))).data)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка при записи состояний FSM: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+
+            # Снимок делаем до первого await: изменения во время записи
+            # снова пометят ключ и уйдут следующей пачкой
+            upserts = []
+            deletes = []
+            for key, record in dirty.items():
+                if record.state is None and not record.data:
+                    deletes.append(key)
+                else:
+                    upserts.append(key + (record.state, json.dumps(record.data, ensure_ascii=False)))
+
+            try:
+                async with self.db.connection() as conn:
+                    async with conn.transaction():
+                        if upserts:
+                            await conn.execute("""
+                                INSERT INTO fsm_storage
+                                    (bot_id, chat_id, user_id, thread_id, destiny, state, data)
+                                SELECT b, c, u, t, d, s, j::jsonb
+                                FROM unnest($1::bigint[], $2::bigint[], $3::bigint[],
+                                            $4::bigint[], $5::text[], $6::text[], $7::text[])
+                                    AS x(b, c, u, t, d, s, j)
+                                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+                                DO UPDATE SET state = EXCLUDED.state,
+                                              data = EXCLUDED.data,
+                                              updated_at = NOW()
+                            """, *zip(*upserts))
+                        if deletes:
+                            await conn.execute("""
+                                DELETE FROM fsm_storage
+                                WHERE (bot_id, chat_id, user_id, thread_id, destiny) IN (
+                                    SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[],
+                                                         $4::bigint[], $5::text[])
+                                )
+                            """, *zip(*deletes))
+                        keys = list(dirty)
+                        for i in range(0, len(keys), NOTIFY_CHUNK):
+                            payload = json.dumps({'origin': self._origin, 'keys': keys[i:i + NOTIFY_CHUNK]})
+                            await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+            except Exception:
+                for key, record in dirty.items():
+                    self._dirty.setdefault(key, record)
+                raise
+            self.writes += len(dirty)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'cached': len(self._cache),
+            'pending': len(self._dirty),
+            'writes': self.writes,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class _MemoryRecord:
+    __slots__ = ('state', 'data', 'expires_at')
+
+    def __init__(self):
+        self.state = 0        # номер состояния в таблице состояний, 0 - нет
+        self.data = None      # данные в pickle, None - пустые
+        self.expires_at = 0.0
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """Хранилище FSM в памяти с ограничением размера.
+
+    Замена MemoryStorage: запись живет ttl секунд с последнего обращения,
+    при превышении max_keys или max_bytes выкидываются самые давно
+    использованные. Состояние хранится номером в общей таблице строк,
+    данные - одним pickle-буфером, пустые записи не хранятся вовсе (чтение
+    несуществующего ключа, в отличие от MemoryStorage, ничего не создает).
+    """
+
+    def __init__(self, ttl=86400, max_keys=50000, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self.expired = 0
+        self._records = OrderedDict()  # ключ -> _MemoryRecord, по давности обращения
+        self._states = [None]
+        self._state_codes = {None: 0}
+
+    async def close(self):
+        pass
+
+    def _encode_state(self, state):
+        code = self._state_codes.get(state)
+        if code is None:
+            code = len(self._states)
+            self._states.append(state)
+            self._state_codes[state] = code
+        return code
+
+    @staticmethod
+    def _size(key, record):
+        size = sys.getsizeof(key) + sys.getsizeof(record)
+        if record.data is not None:
+            size += sys.getsizeof(record.data)
+        return size
+
+    def _drop(self, key):
+        record = self._records.pop(key)
+        self.total_bytes -= self._size(key, record)
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires_at > now:
+                break
+            self._drop(key)
+            self.expired += 1
+        while self._records and (len(self._records) > self.max_keys or self.total_bytes > self.max_bytes):
+            self._drop(next(iter(self._records)))
+            self.evictions += 1
+
+    def _get(self, key):
+        self._purge()
+        record = self._records.get(_key(key))
+        if record is not None:
+            record.expires_at = time.monotonic() + self.ttl
+            self._records.move_to_end(_key(key))
+        return record
+
+    def _update(self, key, state=None, data=None):
+        key = _key(key)
+        record = self._records.get(key)
+        if record is None:
+            record = _MemoryRecord()
+        else:
+            self.total_bytes -= self._size(key, record)
+            del self._records[key]
+        if state is not None:
+            record.state = state
+        if data is not None:
+            record.data = pickle.dumps(data, pickle.HIGHEST_PROTOCOL) if data else None
+
+        if record.state or record.data is not None:
+            record.expires_at = time.monotonic() + self.ttl
+            self._records[key] = record
+            self.total_bytes += self._size(key, record)
+        self._purge()
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        self._update(key, state=self._encode_state(state))
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return self._states[record.state] if record else None
+
+    async def set_data(self, key, data):
+        self._update(key, data=dict(data))
+
+    async def get_data(self, key):
+        record = self._get(key)
+        if record is None or record.data is None:
+            return {}
+        return pickle.loads(record.data)
+
+    def stats(self):
+        return {
+            'live_keys': len(self._records),
+            'bytes': self.total_bytes,
+            'evictions': self.evictions,
+            'expired': self.expired,
+        }
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+
+import config
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+def route_key(update):
+    """id пользователя, от которого пришел апдейт (0, если его нет)"""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+class Worker:
+    """Процесс bot.py в режиме worker и очередь апдейтов для него.
+
+    Апдейты пересылаются строго по одному и по порядку. Если воркер
+    недоступен (перезапускается или упал), пересылка повторяется, пока он
+    не поднимется, поэтому апдейты не теряются.
+    """
+
+    def __init__(self, index, port, secret, queue_size=10000):
+        self.index = index
+        self.port = port
+        self.secret = secret
+        self.url = f"http://127.0.0.1:{port}{config.WEBHOOK_PATH}"
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.proc = None
+        self.forwarded = 0
+        self.restarts = 0
+        self._stopping = False
+        self._restarting = False
+        self._tasks = []
+
+    async def start(self, session):
+        await self._spawn()
+        self._tasks = [
+            asyncio.create_task(self._watch()),
+            asyncio.create_task(self._forward(session)),
+        ]
+
+    async def _spawn(self):
+        env = dict(
+            os.environ,
+            DELIVERY_MODE="worker",
+            WEB_HOST="127.0.0.1",
+            PORT=str(self.port),
+            WEBHOOK_SECRET=self.secret,
+            WORKERS=str(config.WORKERS),
+            WORKER_INDEX=str(self.index),
+        )
+        # Отдельная сессия: Ctrl+C в терминале получает только supervisor,
+        # а воркеры он останавливает сам, дослав им очередь
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, BOT_SCRIPT, env=env, start_new_session=True
+        )
+        print(f"🧩 Воркер {self.index} запущен (pid {self.proc.pid}, порт {self.port})")
+
+    async def _watch(self):
+        """Поднимает воркер заново, если процесс завершился"""
+        while not self._stopping:
+            code = await self.proc.wait()
+            if self._stopping:
+                break
+            if self._restarting:
+                self._restarting = False
+            else:
+                print(f"⚠️ Воркер {self.index} завершился с кодом {code}, перезапускаю")
+                await asyncio.sleep(1)
+            self.restarts += 1
+            await self._spawn()
+
+    async def _forward(self, session):
+        while True:
+            body = await self.queue.get()
+            delay = 0.1
+            while True:
+                try:
+                    async with session.post(
+                        self.url, data=body,
+                        headers={SECRET_HEADER: self.secret, "Content-Type": "application/json"}
+                    ) as resp:
+                        if resp.status == 200:
+                            break
+                        print(f"⚠️ Воркер {self.index} ответил {resp.status}, повторяю")
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2)
+            self.forwarded += 1
+            self.queue.task_done()
+
+    async def wait_ready(self, timeout=60):
+        """Ждет, пока воркер начнет принимать соединения"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+                await writer.wait_closed()
+                return True
+            except OSError:
+                await asyncio.sleep(0.2)
+        return False
+
+    async def restart(self):
+        """Плавный перезапуск: воркер доделывает начатые апдейты и выходит,
+        новые тем временем копятся в очереди"""
+        old = self.proc
+        self._restarting = True
+        old.send_signal(signal.SIGTERM)
+        while self.proc is old:
+            await asyncio.sleep(0.1)
+        await self.wait_ready()
+
+    async def stop(self, timeout=30):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Воркер {self.index}: не доставлено {self.queue.qsize()} апдейтов")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.proc.returncode is None:
+            self.proc.send_signal(signal.SIGTERM)
+            await self.proc.wait()
+
+
+class Supervisor:
+    """Принимает вебхук Telegram и раскладывает апдейты по воркерам.
+
+    Воркер выбирается по id пользователя, поэтому все апдейты одного
+    человека обрабатывает один процесс - его состояние FSM и кэши живут
+    там же, а нагрузка распределяется по ядрам.
+    """
+
+    def __init__(self, workers, base_port, secret):
+        self.secret = secret
+        self.workers = [Worker(i, base_port + i, secret) for i in range(workers)]
+
+    def worker_for(self, user_id):
+        return self.workers[user_id % len(self.workers)]
+
+    async def handle(self, request):
+        if request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401, text="Unauthorized")
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400, text="Bad request")
+        try:
+            self.worker_for(route_key(update)).queue.put_nowait(body)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            return web.Response(status=503, text="Busy")
+        return web.json_response({})
+
+    async def rolling_restart(self):
+        """Перезапускает воркеры по одному (SIGHUP)"""
+        print("🔄 Перезапуск воркеров...")
+        for worker in self.workers:
+            await worker.restart()
+        print("✅ Воркеры перезапущены")
+
+    async def run(self, host, port):
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        for worker in self.workers:
+            await worker.start(session)
+
+        app = web.Application()
+        app.router.add_post(config.WEBHOOK_PATH, self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        print(f"🌐 Supervisor слушает {host}:{port}, воркеров: {len(self.workers)}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.rolling_restart()))
+
+        try:
+            await stop.wait()
+        finally:
+            await site.stop()
+            await asyncio.gather(*(worker.stop() for worker in self.workers))
+            await runner.cleanup()
+            await session.close()
+
+
+async def main():
+    if not config.WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не установлен")
+
+    supervisor = Supervisor(config.WORKERS, config.WORKER_BASE_PORT, config.WEBHOOK_SECRET)
+    bot = Bot(token=config.BOT_TOKEN)
+    try:
+        await bot.set_webhook(
+            config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET
+        )
+    finally:
+        await bot.session.close()
+    print(f"✅ Вебхук установлен: {config.WEBHOOK_URL.rstrip('/')}{config.WEBHOOK_PATH}")
+
+    await supervisor.run(config.WEB_HOST, config.WEB_PORT)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,38 @@
+import re
+
+# Разделители между навыками в свободном тексте анкеты:
+# "Python, ML", "SQL; Excel", "дизайн / UX", "Python и Django"
+_SEPARATORS = re.compile(r"[,;/|\n\r\t]+|\s+(?:и|and|&)\s+|\s+\+\s+", re.IGNORECASE)
+# Мусор по краям тега, но не "+" и "#" (C++, C#) и не точка в начале (.NET)
+_EDGES = re.compile(r"^[\s\-–—:*()\[\]\"'«»!?]+|[\s\-–—:*()\[\]\"'«»!?.]+$")
+
+MAX_TAG_LENGTH = 50
+
+KINDS = ('interest', 'expertise')
+
+
+def normalize_tag(text):
+    """Один навык в каноническом виде: нижний регистр, без лишних пробелов"""
+    tag = _EDGES.sub("", text.strip().lower().replace("ё", "е"))
+    tag = " ".join(tag.split())
+    if not tag or len(tag) > MAX_TAG_LENGTH:
+        return None
+    return tag
+
+
+def tokenize(text):
+    """Теги из поля interest_area/expertise_area, без повторов, по порядку"""
+    if not text:
+        return []
+    tags = []
+    for part in _SEPARATORS.split(text):
+        tag = normalize_tag(part)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def profile_tags(interest, expertise):
+    """Пары (тег, вид) для user_tags"""
+    return [(tag, 'interest') for tag in tokenize(interest)] + \
+           [(tag, 'expertise') for tag in tokenize(expertise)]
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.filters import Command
+
+from webhook import build_app, drain
+
+SECRET = "test-secret"
+
+
+class FakeTelegram(BaseSession):
+    """Сессия вместо api.telegram.org: запоминает запросы бота"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+async def check_webhook():
+    dp = Dispatcher()
+    handled = []
+
+    @dp.message(Command("start"))
+    async def start(message):
+        # Медленный хендлер: апдейты должны обрабатываться параллельно
+        await asyncio.sleep(0.5)
+        handled.append(message.from_user.id)
+
+    session = FakeTelegram()
+    bot = Bot("42:TEST", session=session)
+    app = build_app(dp, bot, "/webhook", SECRET)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        # Без секрета и с неправильным секретом - 401, апдейт не обрабатывается
+        resp = await client.post("/webhook", json=make_update(1, 1, "/start"))
+        assert resp.status == 401, resp.status
+        resp = await client.post(
+            "/webhook", json=make_update(2, 1, "/start"),
+            headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+        )
+        assert resp.status == 401, resp.status
+
+        # Telegram получает ответ сразу, не дожидаясь хендлеров
+        started = time.monotonic()
+        for i in range(10):
+            resp = await client.post(
+                "/webhook", json=make_update(100 + i, 1000 + i, "/start"),
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            )
+            assert resp.status == 200, resp.status
+        assert time.monotonic() - started < 0.5, "вебхук ждет окончания хендлеров"
+
+        # Десять медленных хендлеров укладываются примерно в время одного,
+        # и drain дожидается их всех
+        started = time.monotonic()
+        await drain(app)
+        assert time.monotonic() - started < 0.8, "хендлеры обрабатываются по очереди"
+        assert sorted(handled) == [1000 + i for i in range(10)], handled
+        print("✅ Вебхук принимает апдейты, проверяет секрет и обрабатывает их параллельно")
+    finally:
+        await client.close()
+
+
+def test_webhook():
+    asyncio.run(check_webhook())
+
+
+if __name__ == "__main__":
+    test_webhook()
@@ -1,11 +1,34 @@
 import asyncio
 import aiohttp
+import glob
 import os
+import time
 from datetime import datetime
 from admin import AdminTools, db
 import aiofiles
+import config
 import json
 
+# Потоки инкрементальной выгрузки: таблица, колонки и метка времени, по
+# которой строка считается новой или измененной
+EXPORT_STREAMS = {
+    'users': {
+        'table': 'users',
+        'columns': 'id, telegram_id, name, interest_area, expertise_area, created_at, updated_at',
+        'timestamp': 'updated_at',
+    },
+    'likes': {
+        'table': 'likes',
+        'columns': 'id, from_user_id, to_user_id, created_at',
+        'timestamp': 'created_at',
+    },
+    'skips': {
+        'table': 'skips',
+        'columns': 'id, from_user_id, to_user_id, created_at',
+        'timestamp': 'created_at',
+    },
+}
+
 class DataUploader:
     def __init__(self, webhook_url=None):
         self.webhook_url = webhook_url  # URL твоего сервера для загрузки
@@ -25,7 +48,8 @@ class DataUploader:
                     form_data.add_field('file', 
                                        file_data, 
                                        filename=filename,
-                                       content_type='text/csv' if data_type == 'csv' else 'application/json')
+                                       content_type='application/gzip' if filename.endswith('.gz') else
+                                                    'text/csv' if data_type == 'csv' else 'application/json')
                     form_data.add_field('type', data_type)
                     form_data.add_field('timestamp', datetime.now().isoformat())
                     form_data.add_field('project', 'skillswap_bot')
@@ -60,39 +84,195 @@ class DataUploader:
             print(f"❌ Ошибка при сохранении JSON: {e}")
             return False
     
-    async def daily_export(self):
-        """Ежедневная автоматическая выгрузка"""
+    async def _get_watermark(self, stream):
+        async with db.connection() as conn:
+            mark = await conn.fetchrow("SELECT * FROM export_watermarks WHERE stream = $1", stream)
+            until = await conn.fetchval(
+                "SELECT NOW()::timestamp - make_interval(secs => $1)", config.EXPORT_LAG
+            )
+        return mark, until
+
+    async def _save_watermark(self, stream, until, snapshot, rows):
+        async with db.connection() as conn:
+            await conn.execute("""
+                INSERT INTO export_watermarks
+                    (stream, exported_until, deltas_since_snapshot, snapshot_at, rows_exported)
+                VALUES ($1, $2::timestamp, 0, CASE WHEN $3::boolean THEN $2::timestamp END, $4)
+                ON CONFLICT (stream) DO UPDATE SET
+                    exported_until = EXCLUDED.exported_until,
+                    deltas_since_snapshot = CASE WHEN $3::boolean THEN 0
+                        ELSE export_watermarks.deltas_since_snapshot + 1 END,
+                    snapshot_at = COALESCE(EXCLUDED.snapshot_at, export_watermarks.snapshot_at),
+                    rows_exported = export_watermarks.rows_exported + EXCLUDED.rows_exported,
+                    updated_at = NOW()
+            """, stream, until, snapshot, rows)
+
+    def _compact_local(self, stream, keep):
+        """После снимка старые дельты и снимки потока больше не нужны"""
+        for pattern in (f"{stream}_delta_*.csv.gz", f"{stream}_snapshot_*.csv.gz"):
+            for filename in glob.glob(pattern):
+                if filename != keep:
+                    os.remove(filename)
+
+    async def plan_stream(self, stream, full=False):
+        """(граница прошлой выгрузки, новая граница, снимок ли) для потока.
+
+        Снимок делается при первом запуске, по full=True и каждые
+        EXPORT_SNAPSHOT_EVERY запусков, чтобы получателю не приходилось
+        накатывать бесконечную цепочку дельт.
+        """
+        mark, until = await self._get_watermark(stream)
+        snapshot = full or mark is None or mark['deltas_since_snapshot'] + 1 >= config.EXPORT_SNAPSHOT_EVERY
+        return mark, until, snapshot
+
+    async def export_stream(self, stream, full=False, plan=None):
+        """Выгрузка одного потока: дельта с прошлого запуска или полный снимок.
+
+        Дельта - строки с меткой времени в [прошлая граница, текущая
+        граница); граница сдвигается только после успешной загрузки файла.
+        """
+        spec = EXPORT_STREAMS[stream]
+        mark, until, snapshot = plan or await self.plan_stream(stream, full)
+
+        if snapshot:
+            query = f"""
+                SELECT {spec['columns']} FROM {spec['table']}
+                WHERE {spec['timestamp']} < $1
+                ORDER BY id
+            """
+            args = (until,)
+        else:
+            query = f"""
+                SELECT {spec['columns']} FROM {spec['table']}
+                WHERE {spec['timestamp']} >= $1 AND {spec['timestamp']} < $2
+                ORDER BY {spec['timestamp']}, id
+            """
+            args = (mark['exported_until'], until)
+
+        started = time.perf_counter()
+        kind = 'snapshot' if snapshot else 'delta'
+        filename = f"{stream}_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.gz"
+        async with aiofiles.open(filename, 'wb') as f:
+            rows = await AdminTools.stream_query_csv(query, f.write, *args, database=db)
+        size = os.path.getsize(filename)
+
+        success = await self.upload_to_server(filename, "csv")
+        if success:
+            await self._save_watermark(stream, until, snapshot, rows)
+            if snapshot:
+                self._compact_local(stream, keep=filename)
+
+        elapsed = time.perf_counter() - started
+        print(f"📦 {stream}: {kind}, {rows} строк, {size // 1024} КБ за {elapsed:.2f} с")
+        return {
+            'kind': kind,
+            'file': filename,
+            'rows': rows,
+            'bytes': size,
+            'seconds': round(elapsed, 3),
+            'success': success,
+        }
+
+    async def export_activity(self):
+        """Активность по дням начиная с последнего выгруженного дня.
+
+        Последний день прошлой выгрузки мог быть неполным, поэтому он
+        выгружается повторно; получатель заменяет дни по дате.
+        """
+        mark, until = await self._get_watermark('activity')
+        days = 30
+        if mark is not None:
+            days = min((until.date() - mark['exported_until'].date()).days + 1, 30)
+        activity = await AdminTools.get_activity_timeline(days)
+        activity_file = f"activity_{datetime.now().strftime('%Y%m%d')}.json"
+        success = await self.upload_json_data(activity, activity_file)
+        if success:
+            await self._save_watermark('activity', until, mark is None, len(activity))
+        return {'days': len(activity), 'success': success}
+
+    async def export_user_stats(self):
+        """Полная статистика пользователей с метриками"""
+        csv_file, count = await AdminTools.get_user_stats_csv(db)
+        success = await self.upload_to_server(csv_file, "csv")
+        return {'rows': count, 'success': success}
+
+    async def export_interests(self):
+        top_interests = await AdminTools.get_top_interests(20)
+        interests_file = f"interests_{datetime.now().strftime('%Y%m%d')}.json"
+        success = await self.upload_json_data(top_interests, interests_file)
+        return {'count': len(top_interests), 'success': success}
+
+    async def _run_stage(self, name, coro, timings):
+        """Этап выгрузки с замером времени; ошибка этапа не роняет остальные"""
+        started = time.perf_counter()
         try:
-            await db.create_pool()
+            return await coro
+        except Exception as e:
+            print(f"❌ Этап выгрузки {name} не удался: {e}")
+            return {'success': False, 'error': str(e)}
+        finally:
+            timings[name] = round(time.perf_counter() - started, 3)
+
+    async def daily_export(self, full=False):
+        """Ежедневная автоматическая выгрузка.
+
+        Пользователи, лайки и пропуски выгружаются дельтами (см.
+        export_stream), так что время и объем выгрузки зависят от того,
+        сколько изменилось за день, а не от размера базы. full=True
+        выгружает полные снимки всех потоков.
+
+        Этапы не зависят друг от друга и идут одновременно, каждый на своем
+        соединении из пула: пока один файл загружается на сервер, следующий
+        уже генерируется. Выгрузка занимает примерно столько, сколько
+        самый долгий этап.
+        """
+        try:
+            # Пул и фоновые задачи базы живут, пока жив цикл событий:
+            # планировщик держит один цикл на все выгрузки (scheduler.py)
+            if db.pool is None:
+                await db.create_pool()
             
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M')
             print(f"📤 Начинаю ежедневную выгрузку {timestamp}")
+            started = time.perf_counter()
             
-            # 1. Выгружаем CSV статистику
-            csv_file, count = await AdminTools.get_user_stats_csv()
-            csv_success = await self.upload_to_server(csv_file, "csv")
+            # Снимок или дельта решается заранее, до запуска этапов
+            plans = dict(zip(EXPORT_STREAMS, await asyncio.gather(
+                *(self.plan_stream(stream, full) for stream in EXPORT_STREAMS)
+            )))
             
-            # 2. Выгружаем данные об активности
-            activity = await AdminTools.get_activity_timeline(30)
-            activity_file = f"activity_{datetime.now().strftime('%Y%m%d')}.json"
-            activity_success = await self.upload_json_data(activity, activity_file)
+            stages = {
+                # 1. Пользователи, лайки, пропуски - дельты или снимки
+                **{stream: self.export_stream(stream, plan=plan) for stream, plan in plans.items()},
+                # 2. Активность с последнего выгруженного дня
+                'activity': self.export_activity(),
+                # 3. Топ интересов
+                'interests': self.export_interests(),
+                # 4. Статистика с метриками по всем пользователям - каждый
+                # день: она идет потоком из COPY и не держит выгрузку в памяти
+                'user_stats': self.export_user_stats(),
+            }
             
-            # 3. Выгружаем топ интересов
-            top_interests = await AdminTools.get_top_interests(20)
-            interests_file = f"interests_{datetime.now().strftime('%Y%m%d')}.json"
-            interests_success = await self.upload_json_data(top_interests, interests_file)
+            timings = {}
+            results = dict(zip(stages, await asyncio.gather(
+                *(self._run_stage(name, coro, timings) for name, coro in stages.items())
+            )))
+            elapsed = time.perf_counter() - started
             
-            # 4. Сводный отчет
+            # 5. Сводный отчет
+            streams = {stream: results[stream] for stream in EXPORT_STREAMS}
             summary = {
                 "export_date": datetime.now().isoformat(),
-                "total_users": count,
-                "activity_days": len(activity),
-                "top_interests_count": len(top_interests),
-                "files_exported": {
-                    "csv": csv_success,
-                    "activity": activity_success,
-                    "interests": interests_success
-                }
+                "streams": streams,
+                "activity_days": results['activity'].get('days', 0),
+                "top_interests_count": results['interests'].get('count', 0),
+                "seconds": round(elapsed, 3),
+                # Сколько заняли бы этапы один за другим
+                "sequential_seconds": round(sum(timings.values()), 3),
+                "stages": {
+                    name: {"seconds": timings[name], "success": result['success']}
+                    for name, result in results.items()
+                },
             }
             
             summary_file = f"summary_{datetime.now().strftime('%Y%m%d')}.json"
@@ -102,9 +282,15 @@ class DataUploader:
             if self.webhook_url:
                 await self.upload_to_server(summary_file, "json")
             
-            print(f"✅ Ежедневная выгрузка завершена: пользователей={count}, активность={len(activity)} дней")
+            total_rows = sum(s.get('rows', 0) for s in streams.values())
+            total_bytes = sum(s.get('bytes', 0) for s in streams.values())
+            print(
+                f"✅ Ежедневная выгрузка завершена: {total_rows} строк, {total_bytes // 1024} КБ, "
+                f"активность={summary['activity_days']} дней, {elapsed:.2f} с "
+                f"(по очереди было бы {summary['sequential_seconds']:.2f} с)"
+            )
             
-            return all([csv_success, activity_success, interests_success])
+            return all(result['success'] for result in results.values())
             
         except Exception as e:
             print(f"❌ Ошибка при ежедневной выгрузке: {e}")
@@ -118,12 +304,14 @@ async def test_uploader():
     uploader = DataUploader()  # Без URL - только локальное сохранение
     
     print("🧪 Тестируем загрузчик...")
-    success = await uploader.daily_export()
+    try:
+        success = await uploader.daily_export()
+    finally:
+        await db.close()
     
     if success:
         print("✅ Тест пройден! Проверь файлы в текущей папке:")
-        import glob
-        files = glob.glob("*.csv") + glob.glob("*.json")
+        files = glob.glob("*.csv.gz") + glob.glob("*.json")
         for file in files:
             print(f"   📄 {file}")
     else:
@@ -0,0 +1,105 @@
+import asyncio
+import signal
+
+from aiohttp import web
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+class _TrackedRequestHandler(SimpleRequestHandler):
+    """SimpleRequestHandler, который сам ведет задачи фоновой обработки.
+
+    Фоновый режим aiogram хранит задачи в закрытом атрибуте, поэтому
+    базовому классу передается handle_in_background=False, а ответ
+    без ожидания и учет задач делаются здесь - drain() дожидается их
+    при остановке.
+    """
+
+    def __init__(self, *args, handle_in_background=True, **kwargs):
+        super().__init__(*args, handle_in_background=False, **kwargs)
+        self.in_background = handle_in_background
+        self.tasks = set()
+
+    async def _feed(self, bot, update):
+        result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=bot, result=result)
+
+    async def handle(self, request):
+        if not self.in_background:
+            return await super().handle(request)
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        update = await request.json(loads=bot.session.json_loads)
+        task = asyncio.create_task(self._feed(bot, update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def drain(self, timeout=30):
+        tasks = set(self.tasks)
+        if tasks:
+            print(f"⏳ Дожидаюсь обработки {len(tasks)} апдейтов...")
+            await asyncio.wait(tasks, timeout=timeout)
+
+
+WEBHOOK_HANDLER = web.AppKey("webhook_handler", _TrackedRequestHandler)
+
+
+def build_app(dp, bot, path, secret=None, handle_in_background=True):
+    """aiohttp-приложение, принимающее апдейты Telegram на path.
+
+    Запросы без правильного X-Telegram-Bot-Api-Secret-Token отклоняются
+    с 401. С handle_in_background Telegram сразу получает ответ, а апдейт
+    обрабатывается отдельной задачей параллельно с остальными.
+    """
+    app = web.Application()
+    handler = _TrackedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret,
+        handle_in_background=handle_in_background
+    )
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    app[WEBHOOK_HANDLER] = handler
+    return app
+
+
+async def drain(app, timeout=30):
+    """Дожидается апдейтов, которые еще обрабатываются в фоне"""
+    await app[WEBHOOK_HANDLER].drain(timeout)
+
+
+async def serve(app, host, port):
+    """Запускает сервер и работает до SIGINT/SIGTERM"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"🌐 Вебхук слушает {host}:{port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        # Сначала перестаем принимать запросы, потом доделываем начатое
+        await site.stop()
+        await drain(app)
+        await runner.cleanup()
+
+
+async def run_webhook(dp, bot, url, path, secret, host, port):
+    app = build_app(dp, bot, path, secret)
+    await bot.set_webhook(
+        url.rstrip('/') + path,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    print(f"✅ Вебхук установлен: {url.rstrip('/')}{path}")
+    await serve(app, host, port)
@@ -0,0 +1,193 @@
+import asyncio
+
+import asyncpg
+
+
+class SwipeBuffer:
+    """Буфер лайков и пропусков с отложенной пакетной записью.
+
+    Свайпы копятся в памяти и сбрасываются в likes/skips одним запросом
+    на таблицу: когда набирается max_batch записей, раз в flush_interval
+    секунд и при остановке бота.
+
+    Взаимность save_like проверяет сразу, но встречный лайк может лежать
+    в буфере другого процесса. Такие пары видит только запись пачки
+    (триггер создает строку в matches), и о них сообщается через
+    on_match(from_user_id, to_user_id).
+    """
+
+    def __init__(self, db, max_batch=500, flush_interval=1.0):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self._likes = {}   # (from_user_id, to_user_id) -> сообщено ли о взаимности, порядок вставки
+        self._skips = {}
+        self._flushing_likes = {}  # лайки пачки, которая пишется прямо сейчас
+        self._pending = {}  # from_user_id -> id анкет, еще не записанных в базу
+        self._inflight = {}  # то же для пачки, которая пишется прямо сейчас
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.on_match = None  # async (from_user_id, to_user_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка при записи свайпов: {e}")
+
+    def _added(self, from_user_id, to_user_id):
+        self._pending.setdefault(from_user_id, set()).add(to_user_id)
+        if len(self._likes) + len(self._skips) >= self.max_batch:
+            self._wakeup.set()
+
+    def add_like(self, from_user_id, to_user_id, matched=False):
+        """False, если такой лайк уже ждет записи.
+
+        matched - save_like уже сообщил пользователю о взаимности.
+        """
+        key = (from_user_id, to_user_id)
+        if key in self._likes or key in self._flushing_likes:
+            return False
+        self._likes[key] = matched
+        self._added(from_user_id, to_user_id)
+        return True
+
+    def add_skip(self, from_user_id, to_user_id):
+        self._skips[(from_user_id, to_user_id)] = None
+        self._added(from_user_id, to_user_id)
+
+    def has_like(self, from_user_id, to_user_id):
+        key = (from_user_id, to_user_id)
+        return key in self._likes or key in self._flushing_likes
+
+    def has_pending(self, user_id):
+        return user_id in self._pending or user_id in self._inflight
+
+    def pending_targets(self, user_id):
+        """Анкеты, которые пользователь лайкнул или пропустил, но они еще не в базе"""
+        return list(self._pending.get(user_id, set()) | self._inflight.get(user_id, set()))
+
+    async def flush(self):
+        async with self._flush_lock:
+            likes, self._likes = self._likes, {}
+            skips, self._skips = self._skips, {}
+            self._inflight, self._pending = self._pending, {}
+            self._flushing_likes = likes
+            if not likes and not skips:
+                return
+
+            try:
+                async with self.db.connection() as conn:
+                    inserted = await self._write(conn, 'likes', list(likes))
+                    await self._write(conn, 'skips', list(skips))
+            except Exception:
+                # База недоступна - возвращаем пачку в буфер до следующей попытки
+                self._likes = {**likes, **self._likes}
+                self._skips = {**skips, **self._skips}
+                for user_id, targets in self._inflight.items():
+                    self._pending.setdefault(user_id, set()).update(targets)
+                raise
+            finally:
+                self._inflight = {}
+                self._flushing_likes = {}
+            self.flushed += len(likes) + len(skips)
+
+        if not self.on_match:
+            return
+        try:
+            async with self.db.connection() as conn:
+                matched = await self._matched(conn, inserted)
+        except Exception as e:
+            print(f"❌ Ошибка проверки взаимных лайков пачки: {e}")
+            return
+        # Пары, о которых не сообщили ни тому, ни другому лайку пачки
+        reported = {(min(key), max(key)) for key, flag in likes.items() if flag}
+        for from_id, to_id in matched:
+            if (min(from_id, to_id), max(from_id, to_id)) in reported:
+                continue
+            try:
+                await self.on_match(from_id, to_id)
+            except Exception as e:
+                print(f"❌ Ошибка уведомления о взаимном лайке {from_id}->{to_id}: {e}")
+
+    async def _matched(self, conn, inserted):
+        """Лайки из inserted, после которых в matches есть пара"""
+        if not inserted:
+            return []
+        rows = await conn.fetch("""
+            SELECT l.f, l.t
+            FROM unnest($1::int[], $2::int[]) AS l(f, t)
+            JOIN matches m ON m.user1_id = LEAST(l.f, l.t) AND m.user2_id = GREATEST(l.f, l.t)
+        """, [f for f, _ in inserted], [t for _, t in inserted])
+        # Пара из одной пачки попадает дважды - достаточно одного раза
+        seen = set()
+        result = []
+        for row in rows:
+            pair = (min(row['f'], row['t']), max(row['f'], row['t']))
+            if pair not in seen:
+                seen.add(pair)
+                result.append((row['f'], row['t']))
+        return result
+
+    async def _write(self, conn, table, pairs):
+        """Пишет пачку, возвращает реально вставленные пары"""
+        if not pairs:
+            return []
+        query = f"""
+            INSERT INTO {table} (from_user_id, to_user_id)
+            SELECT * FROM unnest($1::int[], $2::int[])
+            ON CONFLICT DO NOTHING
+            RETURNING from_user_id, to_user_id
+        """
+        # Триггеры счетчиков блокируют строки user_counters и пары
+        # пользователей. Пачки из разных процессов берут их в одном порядке:
+        # счетчики всех участников заранее по возрастанию id, затем строки
+        # по возрастанию пары - так параллельные пачки не ловят deadlock
+        pairs = sorted(pairs, key=lambda p: (min(p), max(p)))
+        from_ids = [f for f, _ in pairs]
+        to_ids = [t for _, t in pairs]
+        try:
+            async with conn.transaction():
+                user_ids = sorted(set(from_ids) | set(to_ids)) if table == 'likes' else sorted(set(from_ids))
+                # Один upsert и для новых, и для существующих строк: все
+                # блокировки берутся за один проход по возрастанию id
+                await conn.execute("""
+                    INSERT INTO user_counters (user_id)
+                    SELECT u.id FROM unnest($1::int[]) AS u(id)
+                    ORDER BY u.id
+                    ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+                """, user_ids)
+                rows = await conn.fetch(query, from_ids, to_ids)
+        except asyncpg.PostgresError as e:
+            # Одна битая запись (например, удаленная анкета) не должна
+            # блокировать всю пачку - пишем по одной и пропускаем ошибочные
+            print(f"⚠️ Пакетная запись в {table} не удалась ({e}), пишу по одной")
+            rows = []
+            for from_id, to_id in pairs:
+                try:
+                    rows.extend(await conn.fetch(query, [from_id], [to_id]))
+                except asyncpg.PostgresError as row_error:
+                    print(f"❌ Не удалось записать {table} {from_id}->{to_id}: {row_error}")
+        return [(row['from_user_id'], row['to_user_id']) for row in rows]